@@ -0,0 +1,117 @@
+# Admission control for the face routes. Every request first needs a token
+# from its client's bucket (rate per second, up to burst saved up), then one
+# of max_inflight slots. When the slots are taken it may wait in a queue of
+# queue_size for at most wait seconds; anything past that is turned away at
+# once with a Retry-After hint, so the voters already admitted keep a bounded
+# latency instead of everyone slowing down together.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    # one bucket per client key; the least recently seen are forgotten past
+    # max_clients, which only ever hands a client a full bucket again
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # 0 if a token was taken, else seconds until the next one
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    def __init__(self, max_inflight, queue_size, wait, rate, burst):
+        self.max_inflight = max_inflight
+        self.queue_size = queue_size
+        self.wait = wait
+        self.buckets = TokenBuckets(rate, burst)
+        self._slots = threading.Semaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        # moving average of how long an admitted request holds its slot
+        self._service = 0.5
+
+    def retry_after(self):
+        # whole seconds until the queue ahead has likely drained
+        backlog = (self._waiting + 1) / self.max_inflight
+        return max(1, math.ceil(backlog * self._service))
+
+    def admit(self, key):
+        # (slot, seconds spent waiting); the slot is a context manager that
+        # gives it back. Raises Rejected rather than queue past the limits.
+        self.throttle(key)
+        return self.acquire()
+
+    def throttle(self, key):
+        # takes one of key's tokens, or raises Rejected
+        wait = self.buckets.take(key)
+        if wait:
+            raise Rejected("rate_limited", max(1, math.ceil(wait)))
+
+    def acquire(self, timed=True):
+        # a slot without touching any bucket, for work that was throttled
+        # once up front. timed=False keeps its hold time out of the average
+        # that Retry-After is estimated from.
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.queue_size:
+                    raise Rejected("queue_full", self.retry_after())
+                self._waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                raise Rejected("timeout", self.retry_after())
+        return _Slot(self, timed), time.perf_counter() - start
+
+    def _release(self, held):
+        # held is None for an untimed slot
+        if held is not None:
+            with self._lock:
+                self._service += 0.2 * (held - self._service)
+        self._slots.release()
+
+
+class _Slot:
+    __slots__ = ("controller", "start", "timed")
+
+    def __init__(self, controller, timed=True):
+        self.controller = controller
+        self.start = time.perf_counter()
+        self.timed = timed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self.start if self.timed else None
+        self.controller._release(held)
+        return False
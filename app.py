@@ -1,106 +1,471 @@
 import base64
+import binascii
 import os
+import click
 import cv2
+import functools
 import hashlib
+import json
 import secrets
 import sqlite3
+import time
+import uuid
 import numpy as np
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
+from flask.sessions import session_json_serializer
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+import archive
+import db
+import import_voters
+import metrics
+import migrations
+import shards
+from admission import AdmissionController, Rejected
+from ballot_queue import BallotQueue
+from db import cast_ballot, get_db
+from detector_pool import DetectorPool, PoolBusy
+from face_index import FaceIndex
+from face_store import FaceSample, TemplateCache, TemplateStore
+from face_tracker import FaceTracker
+from frame_quality import rank_frames
+from live_results import ResultsFeed, snapshot
+from matchers import get_matcher
+from session_store import ServerSessionInterface, make_store
+
+try:
+    from flask_sock import Sock
+except ImportError:  # no WebSocket support: the page sends bursts instead
+    Sock = None
 
 # ----------------------------
 # CONFIG
 # ----------------------------
 app = Flask(__name__)
 app.secret_key = 'your-super-secret-key-change-in-prod'
-DATABASE = 'database.db'
-FACE_DIR = 'faces'
+# larger bodies are refused with 413 before they are read: FACE_MAX_BODY on
+# the face uploads, ROLL_MAX_BODY on /import_voters (a million-voter roll
+# is about 30 MiB)
+FACE_MAX_BODY = int(os.environ.get("FACE_MAX_BODY", 16 << 20))
+ROLL_MAX_BODY = int(os.environ.get("ROLL_MAX_BODY", 256 << 20))
+DATABASE = os.environ.get("DATABASE", 'database.db')
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+# SHARDS>1 splits voters and ballots by constituency over DATABASE plus
+# database.shard<n>.db files, each with its own write lock
+SHARDS = int(os.environ.get("SHARDS", 1))
+SHARD_PATHS = shards.shard_paths(DATABASE, SHARDS)
+FACE_DIR = os.environ.get("FACE_DIR", 'faces')
+
+# Sessions are kept server-side and the cookie holds only an opaque id.
+# SESSION_STORE=sqlite (the default) shares SESSION_DB between every worker
+# on the host; memory is faster but only right for a single worker; cookie
+# keeps Flask's signed-cookie sessions.
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite")
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 30 * 60))
+# an OTP is good for OTP_TTL seconds and OTP_MAX_ATTEMPTS guesses
+OTP_TTL = int(os.environ.get("OTP_TTL", 5 * 60))
+OTP_MAX_ATTEMPTS = int(os.environ.get("OTP_MAX_ATTEMPTS", 5))
+session_backend = None if SESSION_STORE == "cookie" else make_store(SESSION_STORE, SESSION_DB)
+if session_backend is not None:
+    app.session_interface = ServerSessionInterface(session_backend, SESSION_TTL)
 
 os.makedirs(FACE_DIR, exist_ok=True)
 os.makedirs("temp", exist_ok=True)
 
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+db.init_app(app, SHARD_PATHS, DB_POOL_SIZE)
+fan_out = shards.FanOut(SHARDS)
+
+# GROUP_COMMIT=1 hands ballots to a single writer per shard that commits them in batches
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT") == "1"
+BALLOT_BATCH_SIZE = int(os.environ.get("BALLOT_BATCH_SIZE", 256))
+BALLOT_BATCH_WAIT_MS = float(os.environ.get("BALLOT_BATCH_WAIT_MS", 5))
+# a vote waiting longer than this for its batch is answered with CONTENTION
+BALLOT_TIMEOUT = float(os.environ.get("BALLOT_TIMEOUT", 10))
+ballot_queues = (
+    [BallotQueue(path, BALLOT_BATCH_SIZE, BALLOT_BATCH_WAIT_MS, BALLOT_TIMEOUT) for path in SHARD_PATHS]
+    if GROUP_COMMIT else None
+)
+
+# finished elections are moved out to one database file each under here
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+# /results/stream viewers share one snapshot, re-read at most this often
+RESULTS_INTERVAL = float(os.environ.get("RESULTS_INTERVAL", 1.0))
+results_feed = ResultsFeed(SHARD_PATHS, RESULTS_INTERVAL)
+RESULTS_KEEPALIVE = 15.0
+
+# Haar detection runs on its own bounded pool, sized apart from the web workers
+DETECTOR_WORKERS = int(os.environ.get("DETECTOR_WORKERS", os.cpu_count() or 2))
+DETECTOR_QUEUE = int(os.environ.get("DETECTOR_QUEUE", DETECTOR_WORKERS * 4))
+DETECTOR_MODE = os.environ.get("DETECTOR_MODE", "thread")
+DETECTOR_WAIT = float(os.environ.get("DETECTOR_WAIT", 2.0))
+
+detector_pool = DetectorPool(DETECTOR_WORKERS, DETECTOR_QUEUE, DETECTOR_MODE)
+
+# Face uploads are admitted ADMISSION_RATE per second per client (ADMISSION_BURST
+# saved up), ADMISSION_INFLIGHT at a time, with up to ADMISSION_QUEUE more
+# waiting ADMISSION_WAIT seconds; the rest get an immediate 503 + Retry-After
+ADMISSION_INFLIGHT = int(os.environ.get("ADMISSION_INFLIGHT", DETECTOR_WORKERS))
+ADMISSION_QUEUE = int(os.environ.get("ADMISSION_QUEUE", DETECTOR_WORKERS * 4))
+ADMISSION_WAIT = float(os.environ.get("ADMISSION_WAIT", 1.0))
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", 1.0))
+ADMISSION_BURST = float(os.environ.get("ADMISSION_BURST", 3))
+face_admission = AdmissionController(
+    ADMISSION_INFLIGHT, ADMISSION_QUEUE, ADMISSION_WAIT, ADMISSION_RATE, ADMISSION_BURST
+)
+
+# Enrolled faces live in one memory-mapped file under FACE_DIR; recently
+# seen faces are kept in memory along with their matcher features
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 4096))
+template_store = TemplateStore(FACE_DIR)
+template_cache = TemplateCache(template_store, TEMPLATE_CACHE_SIZE)
+# Trust on first use: with ENROLL_ON_FIRST_USE=1 a voter's (or the admin's)
+# first face capture after the OTP becomes their template, so whoever holds
+# an Aadhaar number and its mobile first gets to enroll. Set it to 0 to only
+# accept faces enrolled beforehand with `flask enroll-face`.
+ENROLL_ON_FIRST_USE = os.environ.get("ENROLL_ON_FIRST_USE", "1") == "1"
+
+# 1:N duplicate check at enrollment: coarse scores over the whole roll,
+# then a full matchTemplate on the best few candidates
+DUPLICATE_TOP_K = int(os.environ.get("DUPLICATE_TOP_K", 5))
+DUPLICATE_PREFILTER = float(os.environ.get("DUPLICATE_PREFILTER", 0.5))
+face_index = FaceIndex()
+
+# template (matchTemplate), histogram (calcHist) or cascade (histogram
+# prefilter, then matchTemplate); FACE_MATCH_THRESHOLD overrides the default,
+# and for cascade FACE_MATCH_REJECT_BELOW sets the histogram prefilter's cut
+FACE_MATCHER = os.environ.get("FACE_MATCHER", "template")
+FACE_MATCH_THRESHOLD = os.environ.get("FACE_MATCH_THRESHOLD")
+FACE_MATCH_REJECT_BELOW = os.environ.get("FACE_MATCH_REJECT_BELOW")
+matcher_options = {}
+if FACE_MATCHER == "cascade" and FACE_MATCH_REJECT_BELOW:
+    matcher_options["reject_below"] = float(FACE_MATCH_REJECT_BELOW)
+face_matcher = get_matcher(
+    FACE_MATCHER,
+    threshold=float(FACE_MATCH_THRESHOLD) if FACE_MATCH_THRESHOLD else None,
+    **matcher_options
 )
 
 # ----------------------------
 # IMAGE UTILS
 # ----------------------------
-def save_base64_image(base64_str, path):
-    header, encoded = base64_str.split(",", 1)
-    img_bytes = base64.b64decode(encoded)
-    img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-    cv2.imwrite(path, img)
-
-def detect_and_save_face(path, frame):
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.2, 6, minSize=(80, 80))
+# Set FACE_DEBUG=1 to keep every detected crop under temp/ for inspection
+FACE_DEBUG = os.environ.get("FACE_DEBUG") == "1"
+# Width frames are scaled down to before detection; 0 keeps full resolution
+DETECT_WIDTH = int(os.environ.get("DETECT_WIDTH", 640))
+# The capture page scales frames to this width and JPEG quality before upload
+CAPTURE_WIDTH = int(os.environ.get("CAPTURE_WIDTH", DETECT_WIDTH or 1280))
+CAPTURE_QUALITY = float(os.environ.get("CAPTURE_QUALITY", 0.85))
+# Frames the page captures per click, BURST_INTERVAL_MS apart; the server
+# reads at most MAX_BURST of them
+BURST_FRAMES = int(os.environ.get("BURST_FRAMES", 3))
+BURST_INTERVAL_MS = int(os.environ.get("BURST_INTERVAL_MS", 150))
+MAX_BURST = int(os.environ.get("MAX_BURST", 8))
+# Streaming sessions (/face_stream) get frames this wide and give up after
+# STREAM_MAX_FRAMES; FACE_STREAM=0 turns them off
+STREAM_WIDTH = int(os.environ.get("STREAM_WIDTH", 480))
+STREAM_MAX_FRAMES = int(os.environ.get("STREAM_MAX_FRAMES", 150))
+FACE_STREAM = Sock is not None and os.environ.get("FACE_STREAM", "1") == "1"
+sock = Sock(app) if FACE_STREAM else None
+
+def decode_image_bytes(buf):
+    # encoded image -> grayscale ndarray; frombuffer wraps buf without copying
+    with metrics.FACE_STAGE.time("jpeg_decode"):
+        return cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+def decode_base64_image(base64_str):
+    # data URL -> grayscale ndarray, entirely in memory
+    with metrics.FACE_STAGE.time("base64_decode"):
+        if not isinstance(base64_str, str):
+            raise TypeError("frame is not a data URL")
+        header, encoded = base64_str.split(",", 1)
+        img_bytes = base64.b64decode(encoded, validate=True)
+    return decode_image_bytes(img_bytes)
+
+def decode_frame(decode, buf):
+    # None for a frame that is not an image at all, so one bad frame in a
+    # burst is dropped like an undecodable one instead of failing the request
+    try:
+        return decode(buf)
+    except (TypeError, ValueError, binascii.Error, cv2.error):
+        return None
+
+def read_frames():
+    # The capture burst in the current request, as (grayscale frames, error).
+    # The page posts one raw image/jpeg body or a multipart form with one
+    # 'frame' field per burst frame; the older JSON {"frame": data URL} and
+    # {"frames": [data URLs]} are accepted too. Frames that fail to decode
+    # are dropped as long as one survives.
+    if request.mimetype.startswith("image/"):
+        buffers = [request.get_data(cache=False)]
+        decode = decode_image_bytes
+    elif "frame" in request.files:
+        buffers = [f.read() for f in request.files.getlist("frame")[:MAX_BURST]]
+        decode = decode_image_bytes
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            body = {}
+        buffers = body.get("frames") or [body.get("frame")]
+        buffers = buffers[:MAX_BURST] if isinstance(buffers, list) else []
+        decode = decode_base64_image
+
+    buffers = [buf for buf in buffers if buf]
+    if not buffers:
+        return [], "No frame received"
+    frames = [img for img in (decode_frame(decode, buf) for buf in buffers) if img is not None]
+    if not frames:
+        return [], "Image decode failed"
+    return frames, None
+
+def locate_face(gray, detect_width=None):
+    # run the cascade on a copy scaled down to detect_width and map the
+    # largest box back to full-resolution coordinates
+    if detect_width is None:
+        detect_width = DETECT_WIDTH
+    height, width = gray.shape[:2]
+    scale = 1.0
+    small = gray
+    if detect_width and width > detect_width:
+        scale = detect_width / width
+        small = cv2.resize(
+            gray, (detect_width, max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+
+    # never go below the 24x24 window the cascade was trained on
+    min_side = max(24, round(80 * scale))
+    with metrics.FACE_STAGE.time("detect"):
+        faces = detector_pool.detect(
+            small, timeout=DETECTOR_WAIT, min_size=(min_side, min_side)
+        )
     if len(faces) == 0:
-        return False
+        metrics.DETECTIONS.inc("not_found")
+        return None
+    metrics.DETECTIONS.inc("found")
 
     faces = sorted(faces, key=lambda x: x[2]*x[3], reverse=True)
-    x, y, w, h = faces[0]
-
-    face = gray[y:y+h, x:x+w]
-    face = cv2.resize(face, (200, 200))
-    cv2.imwrite(path, face)
-    return True
+    x, y, w, h = (round(v / scale) for v in faces[0])
+    x, y = max(0, x), max(0, y)
+    return x, y, min(w, width - x), min(h, height - y)
 
-def verify_face(face1_path, face2_path, threshold=0.65):
-    if not (os.path.exists(face1_path) and os.path.exists(face2_path)):
-        return False, 0.0
+def detect_face(gray, detect_width=None):
+    box = locate_face(gray, detect_width)
+    if box is None:
+        return None
 
-    img1 = cv2.imread(face1_path, cv2.IMREAD_GRAYSCALE)
-    img2 = cv2.imread(face2_path, cv2.IMREAD_GRAYSCALE)
-    if img1 is None or img2 is None:
-        return False, 0.0
+    x, y, w, h = box
+    face = gray[y:y+h, x:x+w]
+    return cv2.resize(face, (200, 200))
+
+def detect_best_face(frames):
+    # Try the burst sharpest and best-lit first and stop at the first frame
+    # with a face, so a good burst costs one detection
+    with metrics.FACE_STAGE.time("quality"):
+        order = rank_frames(frames)
+    for tried, i in enumerate(order, start=1):
+        face = detect_face(frames[i])
+        if face is not None:
+            metrics.BURST_DETECT.inc("found", n=tried)
+            return face
+    metrics.BURST_DETECT.inc("not_found", n=len(order))
+    return None
+
+def track_boxes(gray, min_size, max_size):
+    # FaceTracker's detector: a full-frame search until the face is found,
+    # then only the window around it, timed as separate stages
+    stage = "detect" if max_size == (0, 0) else "track"
+    with metrics.FACE_STAGE.time(stage):
+        return detector_pool.detect(
+            gray, timeout=DETECTOR_WAIT, min_size=min_size, max_size=max_size
+        )
+
+def admitted(view):
+    # Runs a face route under face_admission. Clients are told apart by their
+    # session, not their address, since a booth's voters share one.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request.max_content_length = FACE_MAX_BODY
+        try:
+            slot = admit_face()
+        except Rejected as e:
+            status = 429 if e.reason == "rate_limited" else 503
+            resp = jsonify(success=False, msg="Server busy, retrying", retry_after=e.retry_after)
+            return resp, status, {"Retry-After": str(e.retry_after)}
+        with slot:
+            return view(*args, **kwargs)
+    return wrapper
+
+def face_client():
+    return session.get('aadhaar_hash') or session.get('role') or request.remote_addr
+
+def admit_face(stream=False):
+    # a face_admission slot for the current session; raises Rejected. A
+    # stream takes its client's token once when it connects, then a slot
+    # per detection, and those short holds stay out of Retry-After
+    try:
+        if stream:
+            slot, waited = face_admission.acquire(timed=False)
+        else:
+            slot, waited = face_admission.admit(face_client())
+    except Rejected as e:
+        metrics.ADMISSION.inc(e.reason)
+        raise
+    metrics.ADMISSION.inc("admitted")
+    metrics.FACE_STAGE.observe(waited, "admission_wait")
+    return slot
+
+def stream_available():
+    # /face_stream takes over the connection's socket, which only the
+    # threaded servers hand to the app; under asgi.py the page sends bursts
+    return FACE_STREAM and any(
+        k in request.environ for k in ("werkzeug.socket", "gunicorn.socket", "eventlet.input")
+    )
 
-    img1 = cv2.equalizeHist(cv2.resize(img1, (200, 200)))
-    img2 = cv2.equalizeHist(cv2.resize(img2, (200, 200)))
+def save_debug_face(face, prefix):
+    if not FACE_DEBUG:
+        return
+    path = os.path.join("temp", f"{prefix}_{uuid.uuid4().hex}.jpg")
+    cv2.imwrite(path, face)
 
-    score = cv2.matchTemplate(img1, img2, cv2.TM_CCOEFF_NORMED)[0][0]
-    print(f"[DEBUG] Haar face similarity score: {score:.3f}")
-    return score >= threshold, score
+def verify_face(enrolled, live):
+    result = face_matcher.match(enrolled, live)
+    metrics.FACE_STAGE.observe(
+        result.latency_ms / 1000, "match" if result.score is not None else "match_prefiltered"
+    )
+    if FACE_DEBUG:
+        score = "prefiltered" if result.score is None else f"{result.score:.3f}"
+        print(f"[DEBUG] {result.backend} face similarity score: {score} "
+              f"({result.latency_ms:.2f} ms)")
+    return result.matched, result.score
+
+def find_duplicate_face(key, live):
+    with metrics.FACE_STAGE.time("duplicate_search"):
+        candidates = face_index.search(live.equalized, DUPLICATE_TOP_K, exclude=key)
+    for other, coarse in candidates:
+        if coarse < DUPLICATE_PREFILTER:
+            break
+        enrolled = template_cache.get(other)
+        if enrolled is None:
+            continue
+        valid, _ = verify_face(enrolled, live)
+        if valid:
+            return other
+    return None
+
+def check_face(key, face, unique=False):
+    # captures must match the enrolled face; see ENROLL_ON_FIRST_USE for
+    # what happens when there is none yet
+    live = FaceSample(face)
+    enrolled = template_cache.get(key)
+    if enrolled is None:
+        if not ENROLL_ON_FIRST_USE:
+            return False, "No face enrolled, please see an election officer"
+        with template_store.enrolling():
+            # re-checked under the lock: a parallel capture may have won
+            enrolled = template_cache.get(key)
+            if enrolled is None:
+                if enroll_face(key, live, unique):
+                    return False, "Face already enrolled for another voter"
+                return True, None
+
+    valid, score = verify_face(enrolled, live)
+    if not valid:
+        if score is None:
+            return False, "Face mismatch"
+        return False, f"Face mismatch (score: {score:.2f})"
+    return True, None
+
+def enroll_face(key, live, unique):
+    # Call under template_store.enrolling(). With unique, the face is first
+    # searched for among every voter (including those other workers enrolled
+    # since startup) and the matching key is returned instead of enrolling.
+    if unique:
+        build_face_index()
+        other = find_duplicate_face(key, live)
+        if other is not None:
+            return other
+    with metrics.FACE_STAGE.time("enroll"):
+        template_cache.enroll(key, live)
+    if unique:
+        face_index.add(key, live.equalized)
+    return None
+
+def build_face_index():
+    # adds every enrolled voter not yet in face_index
+    keys = template_cache.keys()
+    face_index.reserve(len(keys))
+    for key in keys:
+        if key == "admin_face" or key in face_index:
+            continue
+        sample = template_cache.load(key)
+        if sample is not None:
+            face_index.add(key, sample.equalized)
 
 # ----------------------------
 # DATABASE
 # ----------------------------
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS voters (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        aadhaar_hash TEXT UNIQUE,
-        mobile TEXT,
-        has_voted INTEGER DEFAULT 0
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS votes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        voter_id INTEGER,
-        candidate TEXT,
-        timestamp TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS admin (
-        id INTEGER PRIMARY KEY,
-        username TEXT,
-        password_hash TEXT
-    )''')
-    c.execute(
-        "INSERT OR IGNORE INTO admin VALUES (1,'admin',?)",
-        (hashlib.sha256("admin123".encode()).hexdigest(),)
-    )
-    conn.commit()
-    conn.close()
+def prepare():
+    # one-off setup before the server starts: migrate every shard and move
+    # loose JPEGs into the template store. Workers never do this themselves.
+    init_db()
+    template_store.import_jpegs(FACE_DIR)
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def init_db(path=DATABASE):
+    applied = []
+    for shard_path in shards.shard_paths(path, SHARDS):
+        conn = db.connect(shard_path)
+        applied.append(migrations.migrate(conn))
+        conn.close()
+    return applied
+
+def submit_ballot(shard, voter_id, candidate):
+    if ballot_queues is not None:
+        return ballot_queues[shard].cast(voter_id, candidate)
+    return cast_ballot(get_db(shard), voter_id, candidate)
 
 def generate_otp():
     return str(secrets.randbelow(1000000)).zfill(6)
 
+def rotate_session():
+    # server-side sessions move to a fresh id whenever they gain privilege
+    if hasattr(session, "regenerate"):
+        session.regenerate()
+
+def start_session(role):
+    # a fresh session (and, server-side, a fresh id) with a new OTP in it
+    session.clear()
+    rotate_session()
+    session['role'] = role
+    session['otp'] = generate_otp()
+    session['otp_expires'] = time.time() + OTP_TTL
+    session['otp_attempts'] = 0
+
+def check_otp(entered):
+    # The OTP is single use and dies after OTP_TTL or OTP_MAX_ATTEMPTS wrong
+    # guesses; once it is gone the caller sends the user back to log in.
+    otp = session.get('otp')
+    if otp is None:
+        return False, "OTP expired, please log in again"
+    if time.time() > session.get('otp_expires', 0):
+        end_otp()
+        return False, "OTP expired, please log in again"
+    if secrets.compare_digest(entered.encode(), otp.encode()):
+        end_otp()
+        session['otp_verified'] = True
+        rotate_session()
+        return True, None
+    session['otp_attempts'] = session.get('otp_attempts', 0) + 1
+    if session['otp_attempts'] >= OTP_MAX_ATTEMPTS:
+        end_otp()
+        return False, "Too many wrong OTPs, please log in again"
+    return False, "Invalid OTP"
+
+def end_otp():
+    for key in ('otp', 'otp_expires', 'otp_attempts'):
+        session.pop(key, None)
+
 def hash_aadhaar(a):
     return hashlib.sha256(a.encode()).hexdigest()
 
@@ -118,15 +483,9 @@ def admin_login():
         user = request.form['username']
         pwd = request.form['password']
         conn = get_db()
-        admin = conn.execute(
-            "SELECT * FROM admin WHERE username=?",
-            (user,)
-        ).fetchone()
-        conn.close()
+        admin = conn.execute(db.FIND_ADMIN, (user,)).fetchone()
         if admin and admin['password_hash'] == hashlib.sha256(pwd.encode()).hexdigest():
-            session.clear()
-            session['role'] = 'admin'
-            session['otp'] = generate_otp()
+            start_session('admin')
             flash(f"OTP: {session['otp']}", "info")
             return redirect(url_for('admin_otp'))
         flash("Invalid credentials", "error")
@@ -137,35 +496,47 @@ def admin_otp():
     if session.get('role') != 'admin':
         return redirect('/')
     if request.method == 'POST':
-        if request.form['otp'] == session['otp']:
+        ok, msg = check_otp(request.form['otp'])
+        if ok:
             return redirect(url_for('admin_face'))
-        flash("Invalid OTP", "error")
+        flash(msg, "error")
+        if 'otp' not in session:
+            return redirect(url_for('admin_login'))
     return render_template("otp.html", role="admin")
 
 @app.route('/admin_face')
 def admin_face():
-    if session.get('role') != 'admin':
+    if session.get('role') != 'admin' or not session.get('otp_verified'):
         return redirect('/')
-    return render_template("face_verify.html", role="admin")
+    return render_template(
+        "face_verify.html", role="admin",
+        capture_width=CAPTURE_WIDTH, capture_quality=CAPTURE_QUALITY,
+        burst_frames=BURST_FRAMES, burst_interval=BURST_INTERVAL_MS,
+        stream=stream_available(), stream_width=STREAM_WIDTH
+    )
 
 @app.route('/admin_face_verify', methods=['POST'])
+@admitted
 def admin_face_verify():
-    frame = request.json.get("frame")
-    if not frame:
-        return jsonify(success=False, msg="No frame received")
-
-    temp_img = "temp/admin_live.jpg"
-    save_base64_image(frame, temp_img)
-
-    img = cv2.imread(temp_img)
-    if img is None:
-        return jsonify(success=False, msg="Image decode failed")
-
-    # ONLY DETECT FACE
-    if not detect_and_save_face(temp_img, img):
+    if session.get('role') != 'admin' or not session.get('otp_verified'):
+        return jsonify(success=False, msg="Session expired")
+
+    frames, error = read_frames()
+    if not frames:
+        return jsonify(success=False, msg=error)
+
+    try:
+        face = detect_best_face(frames)
+    except PoolBusy:
+        return jsonify(success=False, msg="Server busy, retrying", retry_after=1), 503, {"Retry-After": "1"}
+    if face is None:
         return jsonify(success=False, msg="Face not detected")
+    save_debug_face(face, "admin")
+
+    ok, msg = check_face("admin_face", face)
+    if not ok:
+        return jsonify(success=False, msg=msg)
 
-    # ✅ ALLOW DIRECTLY
     session['face_verified'] = True
     return jsonify(success=True, redirect="/admin_dashboard")
 
@@ -174,7 +545,32 @@ def admin_face_verify():
 def admin_dashboard():
     if not session.get('face_verified'):
         return redirect('/')
-    return render_template("admin_dashboard.html")
+    elections = shards.list_elections(fan_out, db.get_shards())
+    return render_template("admin_dashboard.html", elections=elections)
+
+@app.route('/start_election', methods=['POST'])
+def start_election():
+    if session.get('role') != 'admin' or not session.get('face_verified'):
+        flash("Admin verification required", "error")
+        return redirect(url_for('admin_login'))
+
+    election_id = shards.start_election(db.get_shards())
+    flash(f"Election {election_id} started", "success")
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/archive_election/<int:election_id>', methods=['POST'])
+def archive_election(election_id):
+    if session.get('role') != 'admin' or not session.get('face_verified'):
+        flash("Admin verification required", "error")
+        return redirect(url_for('admin_login'))
+
+    if election_id == db.current_election(get_db()):
+        flash("The running election cannot be archived", "error")
+    elif archive.start_archive(SHARD_PATHS, election_id, ARCHIVE_DIR):
+        flash(f"Archiving election {election_id} in the background", "success")
+    else:
+        flash(f"Election {election_id} is already being archived", "error")
+    return redirect(url_for('admin_dashboard'))
 
 # -------- USER FLOW --------
 @app.route('/user_login', methods=['GET','POST'])
@@ -182,17 +578,13 @@ def user_login():
     if request.method == 'POST':
         aadhaar = hash_aadhaar(request.form['aadhaar'])
         mobile = request.form['mobile']
-        conn = get_db()
-        voter = conn.execute(
-            "SELECT * FROM voters WHERE aadhaar_hash=? AND mobile=?",
-            (aadhaar, mobile)
-        ).fetchone()
-        conn.close()
+        with metrics.DB_QUERY.time("user_login", "find_voter"):
+            voter, shard = shards.find_voter(fan_out, db.get_shards(), aadhaar, mobile)
         if voter:
-            session.clear()
-            session['role'] = 'voter'
+            start_session('voter')
+            session['shard'] = shard
             session['voter_id'] = voter['id']
-            session['otp'] = generate_otp()
+            session['aadhaar_hash'] = voter['aadhaar_hash']
             flash(f"OTP: {session['otp']}", "info")
             return redirect(url_for('user_otp'))
         flash("Invalid details", "error")
@@ -203,37 +595,165 @@ def user_otp():
     if session.get('role') != 'voter':
         return redirect('/')
     if request.method == 'POST':
-        if request.form['otp'] == session['otp']:
+        ok, msg = check_otp(request.form['otp'])
+        if ok:
             return redirect(url_for('user_face'))
-        flash("Invalid OTP", "error")
+        flash(msg, "error")
+        if 'otp' not in session:
+            return redirect(url_for('user_login'))
     return render_template("otp.html", role="voter")
 
 @app.route('/user_face')
 def user_face():
-    if session.get('role') != 'voter':
+    if session.get('role') != 'voter' or not session.get('otp_verified'):
         return redirect('/')
-    return render_template("face_verify.html", role="voter")
+    return render_template(
+        "face_verify.html", role="voter",
+        capture_width=CAPTURE_WIDTH, capture_quality=CAPTURE_QUALITY,
+        burst_frames=BURST_FRAMES, burst_interval=BURST_INTERVAL_MS,
+        stream=stream_available(), stream_width=STREAM_WIDTH
+    )
 
 @app.route('/user_face_verify', methods=['POST'])
+@admitted
 def user_face_verify():
-    frame = request.json.get("frame")
-    if not frame:
-        return jsonify(success=False, msg="No frame received")
+    if session.get('role') != 'voter' or not session.get('otp_verified'):
+        return jsonify(success=False, msg="Session expired")
+
+    frames, error = read_frames()
+    if not frames:
+        return jsonify(success=False, msg=error)
+
+    try:
+        face = detect_best_face(frames)
+    except PoolBusy:
+        return jsonify(success=False, msg="Server busy, retrying", retry_after=1), 503, {"Retry-After": "1"}
+    if face is None:
+        return jsonify(success=False, msg="Face not detected")
+    save_debug_face(face, "user")
 
-    temp_img = "temp/user_live.jpg"
-    save_base64_image(frame, temp_img)
+    ok, msg = check_face(session['aadhaar_hash'], face, unique=True)
+    if not ok:
+        return jsonify(success=False, msg=msg)
 
-    img = cv2.imread(temp_img)
-    if img is None:
-        return jsonify(success=False, msg="Image decode failed")
+    session['face_verified'] = True
+    return jsonify(success=True, redirect="/vote")
 
-    # ONLY DETECT FACE
-    if not detect_and_save_face(temp_img, img):
-        return jsonify(success=False, msg="Face not detected")
+# -------- FACE STREAM --------
+# The page streams small JPEG frames over a WebSocket and gets a JSON status
+# back for each. The face is found once, then tracked in a small window until
+# it holds steady, and that crop is checked like a captured one. The session
+# cookie cannot be set over the socket, so a pass is handed back instead and
+# redeemed at /face_stream/complete, which may land on another worker. The
+# pass lives in the session store; with cookie sessions it is signed instead.
+STREAM_PASS_TTL = 30
+STREAM_PASS_PREFIX = "stream_pass:"
+stream_pass_signer = URLSafeTimedSerializer(app.secret_key, salt="face-stream-pass")
+
+def face_subject():
+    # (template key, unique, redirect) for whoever is verifying, or None
+    if not session.get('otp_verified'):
+        return None
+    if session.get('role') == 'admin':
+        return "admin_face", False, "/admin_dashboard"
+    if session.get('role') == 'voter' and session.get('aadhaar_hash'):
+        return session['aadhaar_hash'], True, "/vote"
+    return None
+
+def issue_stream_pass(key):
+    if session_backend is None:
+        return stream_pass_signer.dumps(key)
+    token = secrets.token_urlsafe(24)
+    # stored like a session without a role, in case the token is ever sent as a sid
+    payload = session_json_serializer.dumps({"stream_pass": key})
+    session_backend.set(STREAM_PASS_PREFIX + token, payload, time.time() + STREAM_PASS_TTL)
+    return token
+
+def redeem_stream_pass(token):
+    # the template key the pass was issued for, or None if unknown or expired
+    if session_backend is None:
+        try:
+            return stream_pass_signer.loads(token, max_age=STREAM_PASS_TTL)
+        except BadSignature:
+            return None
+    entry = session_backend.get(STREAM_PASS_PREFIX + token)
+    if entry is None:
+        return None
+    session_backend.delete(STREAM_PASS_PREFIX + token)
+    return session_json_serializer.loads(entry[1]).get("stream_pass")
+
+def stream_session(ws, key, unique):
+    # runs the socket until a crop is accepted or rejected; returns the final message
+    tracker = FaceTracker(track_boxes)
+    for _ in range(STREAM_MAX_FRAMES):
+        data = ws.receive(timeout=10)
+        if not isinstance(data, bytes):
+            return {"success": False, "msg": "Stream ended"}
+        img = decode_image_bytes(data) if data else None
+        if img is None:
+            ws.send(json.dumps({"state": "bad_frame"}))
+            continue
+
+        try:
+            with admit_face(stream=True):
+                box = tracker.update(img)
+        except (Rejected, PoolBusy):
+            ws.send(json.dumps({"state": "busy"}))
+            continue
+        if box is None:
+            ws.send(json.dumps({"state": "searching"}))
+            continue
+        if not tracker.steady:
+            ws.send(json.dumps({"state": "hold", "box": box}))
+            continue
+
+        x, y, w, h = box
+        face = cv2.resize(img[y:y+h, x:x+w], (200, 200))
+        save_debug_face(face, "stream")
+        try:
+            with admit_face(stream=True):
+                ok, msg = check_face(key, face, unique=unique)
+        except Rejected:
+            ws.send(json.dumps({"state": "busy"}))
+            continue
+        if not ok:
+            return {"success": False, "msg": msg}
+        metrics.STREAM_SEARCHES.inc("full", n=tracker.full_searches)
+        metrics.STREAM_SEARCHES.inc("window", n=tracker.window_searches)
+        return {"success": True, "token": issue_stream_pass(key)}
+    return {"success": False, "msg": "Face not detected"}
+
+if sock is not None:
+    @sock.route('/face_stream')
+    def face_stream(ws):
+        subject = face_subject()
+        if subject is None:
+            ws.send(json.dumps({"success": False, "msg": "Session expired"}))
+            return
+        key, unique, _ = subject
+        # the stream is rate limited as one request; its frames then queue
+        # for slots alongside uploads. A refused page waits retry_after and
+        # reconnects.
+        try:
+            face_admission.throttle(face_client())
+        except Rejected as e:
+            metrics.ADMISSION.inc(e.reason)
+            ws.send(json.dumps({"success": False, "msg": "Server busy, retrying", "retry_after": e.retry_after}))
+            ws.close(1013, "Try again later")
+            return
+        ws.send(json.dumps(stream_session(ws, key, unique)))
+
+@app.route('/face_stream/complete', methods=['POST'])
+def face_stream_complete():
+    subject = face_subject()
+    if subject is None:
+        return jsonify(success=False, msg="Session expired")
+    token = (request.get_json(silent=True) or {}).get("token", "")
+    if not isinstance(token, str) or redeem_stream_pass(token) != subject[0]:
+        return jsonify(success=False, msg="Verification expired, please retry")
 
-    # ✅ ALLOW DIRECTLY
     session['face_verified'] = True
-    return jsonify(success=True, redirect="/vote")
+    return jsonify(success=True, redirect=subject[2])
 
 @app.route('/results')
 def results():
@@ -241,39 +761,40 @@ def results():
         flash("Admin verification required", "error")
         return redirect(url_for('admin_login'))
 
-    conn = get_db()
-
-    voters_count = conn.execute(
-        'SELECT COUNT(*) as total FROM voters'
-    ).fetchone()['total']
-
-    total_votes = conn.execute(
-        'SELECT COUNT(*) as total FROM votes'
-    ).fetchone()['total']
-
-    candidates = conn.execute('''
-        SELECT candidate, COUNT(*) as count
-        FROM votes
-        GROUP BY candidate
-        ORDER BY count DESC
-    ''').fetchall()
-
-    conn.close()
+    conns = db.get_shards()
+    with metrics.DB_QUERY.time("results", "current_election"):
+        current = db.current_election(conns[0])
+    election_id = request.args.get('election', current, type=int)
+    with metrics.DB_QUERY.time("results", "read_tallies"):
+        latest = snapshot(fan_out, conns, election_id)
+    return render_template('results.html', live=election_id == current, **latest)
 
-    results_list = []
-    for row in candidates:
-        pct = round((row['count'] / total_votes * 100), 1) if total_votes else 0
-        results_list.append({
-            'candidate': row['candidate'],
-            'votes': row['count'],
-            'pct': pct
-        })
-
-    return render_template(
-        'results.html',
-        voters_count=voters_count,
-        total_votes=total_votes,
-        results=results_list
+@app.route('/results/stream')
+def results_stream():
+    if session.get('role') != 'admin' or not session.get('face_verified'):
+        return "", 403
+
+    # set by asgi.py once the client hangs up; polled every second so a
+    # closed dashboard gives its thread back while nothing is being sent
+    gone = request.environ.get("asgi.disconnected")
+
+    def events():
+        version, idle = 0, 0.0
+        while gone is None or not gone.is_set():
+            version, latest = results_feed.wait(version, timeout=1.0)
+            if latest is not None:
+                idle = 0.0
+                yield f"data: {json.dumps(latest)}\n\n"
+                continue
+            idle += 1.0
+            if idle >= RESULTS_KEEPALIVE:
+                idle = 0.0
+                yield ": keepalive\n\n"
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @app.route('/add_voter', methods=['GET', 'POST'])
@@ -285,16 +806,21 @@ def add_voter():
     if request.method == 'POST':
         aadhaar = request.form['aadhaar']
         mobile = request.form['mobile']
+        constituency = request.form.get('constituency', '').strip()
         aadhaar_hash = hash_aadhaar(aadhaar)
 
         try:
-            conn = get_db()
-            conn.execute(
-                'INSERT INTO voters (aadhaar_hash, mobile) VALUES (?, ?)',
-                (aadhaar_hash, mobile)
-            )
-            conn.commit()
-            conn.close()
+            # the UNIQUE index only covers the voter's own shard
+            if SHARDS > 1:
+                with metrics.DB_QUERY.time("add_voter", "is_enrolled"):
+                    enrolled = shards.is_enrolled(fan_out, db.get_shards(), aadhaar_hash)
+                if enrolled:
+                    raise sqlite3.IntegrityError("aadhaar_hash")
+            conn = get_db(shards.shard_for(constituency, SHARDS))
+            with metrics.DB_QUERY.time("add_voter", "insert_voter"):
+                conn.execute(db.INSERT_VOTER, (aadhaar_hash, mobile, constituency))
+                db.count_voters(conn)
+                conn.commit()
 
             flash("Voter added successfully!", "success")
             return redirect(url_for('add_voter'))
@@ -304,6 +830,47 @@ def add_voter():
 
     return render_template('add_voter.html')
 
+@app.route('/import_voters', methods=['POST'])
+def import_voters_upload():
+    if session.get('role') != 'admin' or not session.get('face_verified'):
+        flash("Admin verification required", "error")
+        return redirect(url_for('admin_login'))
+
+    request.max_content_length = ROLL_MAX_BODY
+    roll = request.files.get('roll')
+    if not roll or not roll.filename:
+        flash("No roll file uploaded", "error")
+        return redirect(url_for('add_voter'))
+
+    ext = os.path.splitext(roll.filename)[1].lower()
+    if ext not in (".csv", ".ndjson", ".jsonl"):
+        flash("Roll must be a .csv or .ndjson file", "error")
+        return redirect(url_for('add_voter'))
+
+    path = os.path.join("temp", f"roll_{uuid.uuid4().hex}{ext}")
+    roll.save(path)
+    try:
+        # rejects are named after the content, so a resumed upload appends
+        # to the file its first attempt started; hashing stays in this
+        # thread rather than forking worker processes from a request
+        key = import_voters.source_key(path)
+        rejects_path = os.path.join("temp", f"roll_{key.split(':')[0][:16]}.rejects.csv")
+        stats = import_voters.run_import(
+            SHARD_PATHS, path, hash_aadhaar, rejects_path, workers=0, key=key
+        )
+    except sqlite3.Error as e:
+        flash(f"Import stopped: {e}. Upload the same file again to resume.", "error")
+        return redirect(url_for('add_voter'))
+    finally:
+        os.remove(path)
+
+    flash(
+        f"Imported {stats['inserted']} voters, rejected {stats['rejected']} "
+        f"({stats['rows_per_sec']:.0f} rows/s). Rejects: {stats['rejects_path']}",
+        "success"
+    )
+    return redirect(url_for('add_voter'))
+
 @app.route('/vote', methods=['GET', 'POST'])
 def vote():
     if not session.get('face_verified') or session.get('role') != 'voter':
@@ -313,26 +880,19 @@ def vote():
         candidate = request.form['candidate']
         voter_id = session['voter_id']
 
-        conn = get_db_connection()
-        voter = conn.execute(
-            'SELECT has_voted FROM voters WHERE id = ?', (voter_id,)
-        ).fetchone()
-
-        if voter and voter['has_voted'] == 0:
-            conn.execute(
-                'INSERT INTO votes (voter_id, candidate, timestamp) VALUES (?, ?, ?)',
-                (voter_id, candidate, datetime.now().isoformat())
-            )
-            conn.execute(
-                'UPDATE voters SET has_voted = 1 WHERE id = ?', (voter_id,)
-            )
-            conn.commit()
-            conn.close()
-
+        with metrics.DB_QUERY.time("vote", "cast_ballot"):
+            outcome = submit_ballot(session.get('shard', 0), voter_id, candidate)
+        metrics.VOTES.inc(outcome)
+        if outcome == db.CAST:
             session.clear()
             flash("Vote cast successfully!", "success")
             return redirect(url_for('index'))
 
+        if outcome == db.CONTENTION:
+            metrics.LOCK_RETRIES.inc("vote")
+            flash("Server busy, please try again", "error")
+            return redirect(url_for('vote'))
+
         flash("Already voted", "error")
         return redirect(url_for('index'))
 
@@ -340,6 +900,13 @@ def vote():
     return render_template('vote.html', candidates=candidates)
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.ENABLED:
+        return "metrics are off; set METRICS=1\n", 404, {"Content-Type": "text/plain"}
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
 @app.route('/logout', methods=['GET', 'POST'])
 def logout_user():
     session.clear()
@@ -347,6 +914,97 @@ def logout_user():
 
 
 # ----------------------------
-if __name__ == "__main__":
+# CLI
+# ----------------------------
+@app.cli.command("prepare")
+def prepare_command():
+    prepare()
+    click.echo("Databases migrated and faces imported.")
+
+@app.cli.command("enroll-face")
+@click.argument("who")
+@click.argument("image", type=click.Path(exists=True, dir_okay=False))
+def enroll_face_command(who, image):
+    # WHO is a voter's Aadhaar number or "admin"; an existing face is
+    # replaced, but a voter's face is refused if another voter already has it
+    key = "admin_face" if who == "admin" else hash_aadhaar(who)
+    img = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise click.ClickException(f"Cannot read {image}")
+    face = detect_face(img, detect_width=0)
+    if face is None:
+        raise click.ClickException("No face found in the image")
+    with template_store.enrolling():
+        if enroll_face(key, FaceSample(face), unique=who != "admin"):
+            raise click.ClickException("This face is already enrolled for another voter")
+    click.echo(f"Face enrolled for {who}.")
+
+@app.cli.command("check-tallies")
+@click.option("--fix", is_flag=True, help="Rewrite drifted tallies from the votes table.")
+def check_tallies_command(fix):
     init_db()
+    drift = []
+    for shard, path in enumerate(SHARD_PATHS):
+        conn = db.connect(path)
+        drift.extend(
+            (f"shard {shard} {name}" if SHARDS > 1 else name, stored, actual)
+            for name, stored, actual in db.check_tallies(conn, fix=fix)
+        )
+        conn.close()
+    for name, stored, actual in drift:
+        click.echo(f"{name}: stored {stored}, actual {actual}")
+    if not drift:
+        click.echo("Tallies match the votes table.")
+    elif fix:
+        click.echo("Tallies rebuilt.")
+    else:
+        raise SystemExit(1)
+
+@app.cli.command("revoke-sessions")
+def revoke_sessions_command():
+    if SESSION_STORE != "sqlite":
+        raise click.ClickException(
+            "Only SESSION_STORE=sqlite is shared with this command; "
+            "restart the workers to drop memory sessions, or rotate the secret key for cookie ones."
+        )
+    click.echo(f"Revoked {session_backend.clear()} sessions.")
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    init_db()
+    # every shard has the same schema and indexes
+    conn = db.connect(DATABASE)
+    scans = migrations.table_scans(conn)
+    conn.close()
+    for name, details in scans.items():
+        for detail in details:
+            click.echo(f"{name}: {detail}")
+    if scans:
+        raise SystemExit(1)
+    click.echo("Every hot query is served by an index.")
+
+@app.cli.command("start-election")
+def start_election_command():
+    init_db()
+    conns = [db.connect(path) for path in SHARD_PATHS]
+    election_id = shards.start_election(conns)
+    for conn in conns:
+        conn.close()
+    click.echo(f"Election {election_id} started; earlier results are kept.")
+
+@app.cli.command("archive-election")
+@click.argument("election_id", type=int)
+def archive_election_command(election_id):
+    init_db()
+    for shard, db_path in enumerate(SHARD_PATHS):
+        try:
+            path, deleted = archive.archive_election(db_path, election_id, ARCHIVE_DIR, shard)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Election {election_id} archived to {path} ({deleted} rows moved).")
+
+# ----------------------------
+if __name__ == "__main__":
+    prepare()
+    build_face_index()
     app.run(debug=True)
@@ -0,0 +1,220 @@
+# Move a finished election's ballots out of the live database into
+# archive/election_<id>.db (election_<id>.shard<n>.db for the other shards).
+#
+#   flask --app app archive-election 3
+#
+# Rows are copied in chunks into an attached file, which takes no lock on
+# the live database, then deleted from it in chunks of their own short
+# write transactions, so ballots in the running election only ever wait
+# for one chunk. The election row and its tally stay behind for /results.
+import logging
+import os
+import threading
+import time
+
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+CHUNK_ROWS = 1000
+# let waiting voters in between delete chunks
+CHUNK_PAUSE = 0.01
+
+# (table, column the chunks walk in order)
+ARCHIVED_TABLES = (("votes", "id"), ("turnout", "voter_id"))
+
+# elections being archived by this process; other processes are kept out
+# by the flock on each shard's archive file
+_running = set()
+_running_lock = threading.Lock()
+
+
+def archive_path(archive_dir, election_id, shard=0):
+    suffix = f".shard{shard}" if shard else ""
+    return os.path.join(archive_dir, f"election_{election_id}{suffix}.db")
+
+
+def _claim(path):
+    # An exclusive, non-blocking lock next to one archive file, held for the
+    # whole copy and purge, so two workers never copy over each other's file.
+    # Returns the open lock file, or None if another process holds it.
+    lock = open(f"{path}.lock", "ab")
+    if fcntl:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+    return lock
+
+
+def _claim_all(db_paths, election_id, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    locks = []
+    for shard in range(len(db_paths)):
+        lock = _claim(archive_path(archive_dir, election_id, shard))
+        if lock is None:
+            for held in locks:
+                held.close()
+            return None
+        locks.append(lock)
+    return locks
+
+
+def copy_sql(table, key):
+    return (
+        f"SELECT * FROM main.{table} WHERE election_id = ? AND {key} > ? "
+        f"ORDER BY {key} LIMIT ?"
+    )
+
+
+def purge_sql(table, key):
+    return (
+        f"DELETE FROM {table} WHERE election_id = ? AND {key} IN "
+        f"(SELECT {key} FROM {table} WHERE election_id = ? LIMIT ?)"
+    )
+
+
+def _copy_table(conn, table, key, election_id, chunk):
+    conn.execute(f"CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+    last, copied = -1, 0
+    while True:
+        rows = conn.execute(copy_sql(table, key), (election_id, last, chunk)).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            f"INSERT INTO archive.{table} VALUES ({','.join('?' * len(rows[0]))})",
+            rows
+        )
+        conn.commit()
+        last = rows[-1][key]
+        copied += len(rows)
+    return copied
+
+
+def _copy_out(conn, election_id, path, chunk):
+    # a file left by an interrupted copy is incomplete; start it over
+    if os.path.exists(path):
+        os.remove(path)
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    try:
+        conn.execute(
+            "CREATE TABLE archive.elections AS SELECT * FROM main.elections WHERE id = ?",
+            (election_id,)
+        )
+        conn.execute(
+            "CREATE TABLE archive.election_tally AS "
+            "SELECT * FROM main.election_tally WHERE election_id = ?",
+            (election_id,)
+        )
+        conn.commit()
+        counts = {
+            table: _copy_table(conn, table, key, election_id, chunk)
+            for table, key in ARCHIVED_TABLES
+        }
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+    expected = conn.execute(
+        'SELECT votes FROM elections WHERE id = ?', (election_id,)
+    ).fetchone()[0]
+    if counts["votes"] != expected:
+        raise RuntimeError(
+            f"Election {election_id}: copied {counts['votes']} votes, expected {expected}"
+        )
+    conn.execute(
+        'UPDATE elections SET archived_to = ? WHERE id = ?', (path, election_id)
+    )
+    conn.commit()
+
+
+def _purge(conn, election_id, chunk, pause):
+    deleted = 0
+    for table, key in ARCHIVED_TABLES:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                n = conn.execute(
+                    purge_sql(table, key), (election_id, election_id, chunk)
+                ).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            deleted += n
+            if n < chunk:
+                break
+            time.sleep(pause)
+    return deleted
+
+
+def archive_election(db_path, election_id, archive_dir="archive", shard=0,
+                     chunk=CHUNK_ROWS, pause=CHUNK_PAUSE):
+    # Returns (archive file, rows deleted from the live database). Safe to
+    # re-run after a crash: an unfinished copy is redone, an unfinished
+    # purge carries on.
+    os.makedirs(archive_dir, exist_ok=True)
+    lock = _claim(archive_path(archive_dir, election_id, shard))
+    if lock is None:
+        raise ValueError(f"Election {election_id} is already being archived")
+    try:
+        return _archive(db_path, election_id, archive_dir, shard, chunk, pause)
+    finally:
+        lock.close()
+
+
+def _archive(db_path, election_id, archive_dir, shard, chunk, pause):
+    conn = db.connect(db_path)
+    try:
+        row = conn.execute(
+            'SELECT archived_to FROM elections WHERE id = ?', (election_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No election {election_id}")
+        if election_id == db.current_election(conn):
+            raise ValueError(f"Election {election_id} is still running")
+
+        path = row['archived_to']
+        if path is None:
+            path = archive_path(archive_dir, election_id, shard)
+            _copy_out(conn, election_id, path, chunk)
+        deleted = _purge(conn, election_id, chunk, pause)
+    finally:
+        conn.close()
+    return path, deleted
+
+
+def start_archive(db_paths, election_id, archive_dir="archive"):
+    # Archive every shard, one after another, on a background thread.
+    # Returns False if this election is already being archived, by this
+    # process or another one.
+    with _running_lock:
+        if election_id in _running:
+            return False
+        locks = _claim_all(db_paths, election_id, archive_dir)
+        if locks is None:
+            return False
+        _running.add(election_id)
+
+    def run():
+        try:
+            for shard, db_path in enumerate(db_paths):
+                path, deleted = _archive(
+                    db_path, election_id, archive_dir, shard, CHUNK_ROWS, CHUNK_PAUSE
+                )
+                log.info("election %s archived to %s (%s rows moved)", election_id, path, deleted)
+        except Exception:
+            log.exception("archiving election %s failed", election_id)
+        finally:
+            for lock in locks:
+                lock.close()
+            with _running_lock:
+                _running.discard(election_id)
+
+    threading.Thread(target=run, name=f"archive-{election_id}", daemon=True).start()
+    return True
@@ -0,0 +1,216 @@
+# ASGI entry point, for serving without a thread per connection:
+#
+#   flask --app app prepare
+#   uvicorn asgi:application --workers 4
+#
+# `prepare` migrates every shard and imports loose face images once, before
+# any worker starts; a worker only checks the schema is current and loads
+# its read-only face index when the server starts it up. Sessions need a
+# store every worker can see: keep the default SESSION_STORE=sqlite (or
+# cookie); SESSION_STORE=memory is only right with a single worker, since a
+# voter whose requests land on another worker would appear logged out.
+#
+# The Flask views stay synchronous and run through asgiref's WsgiToAsgi;
+# this module decides which threads they run on. Request bodies are read on
+# the event loop, so a camera upload trickling in over a bad booth network
+# costs a coroutine, not a thread. Only a complete request is handed to a
+# thread. Face uploads and the roll import run on their own FACE_THREADS
+# pool, /results/stream on STREAM_THREADS, and everything else on
+# ASGI_THREADS, so neither slow image work nor open dashboards can take the
+# threads that serve /, /user_otp or /results. Detection itself still runs
+# on the app's detector pool (DETECTOR_MODE=process moves it out of the
+# interpreter).
+#
+# The /face_stream WebSocket needs the threaded server; here it is refused
+# and the page sends bursts instead.
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as voting_app
+import db
+import migrations
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 32))
+# enough face threads for every admitted and queued upload, so the
+# admission controller rather than this pool decides who waits
+FACE_THREADS = int(os.environ.get(
+    "FACE_THREADS", voting_app.ADMISSION_INFLIGHT + voting_app.ADMISSION_QUEUE + 4
+))
+# one per open results dashboard
+STREAM_THREADS = int(os.environ.get("STREAM_THREADS", 64))
+FACE_PATHS = ("/admin_face_verify", "/user_face_verify", "/import_voters")
+STREAM_PATHS = ("/results/stream",)
+# bodies beyond these are refused while still arriving, before any thread
+# is involved: the roll import has its own, larger limit
+MAX_BODY = voting_app.FACE_MAX_BODY
+BODY_LIMITS = {"/import_voters": voting_app.ROLL_MAX_BODY}
+
+_pages = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix="asgi-page")
+_faces = ThreadPoolExecutor(FACE_THREADS, thread_name_prefix="asgi-face")
+_streams = ThreadPoolExecutor(STREAM_THREADS, thread_name_prefix="asgi-stream")
+
+
+class _Disconnected(Exception):
+    pass
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class _Request(WsgiToAsgiInstance):
+    # asgiref's per-request adapter with three changes: the view runs on the
+    # executor its path belongs to instead of asgiref's one shared thread, an
+    # oversized body is refused as it arrives, and the client hanging up sets
+    # environ["asgi.disconnected"], after which anything the view still sends
+    # raises and ends the response
+    def __init__(self, wsgi_application, executor, max_body):
+        super().__init__(wsgi_application)
+        self.executor = executor
+        self.max_body = max_body
+        self.disconnected = threading.Event()
+        self.watcher = None
+
+    async def __call__(self, scope, receive, send):
+        size = 0
+
+        async def read_body():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise _Disconnected
+            size += len(message.get("body", b""))
+            if size > self.max_body:
+                raise _TooLarge
+            if not message.get("more_body"):
+                # the body is complete, so the next message is the disconnect
+                self.watcher = asyncio.ensure_future(self._watch(receive))
+            return message
+
+        async def checked_send(message):
+            if self.disconnected.is_set():
+                raise _Disconnected
+            await send(message)
+
+        try:
+            await super().__call__(scope, read_body, checked_send)
+        except _TooLarge:
+            await send({"type": "http.response.start", "status": 413, "headers": []})
+            await send({"type": "http.response.body", "body": b"Request too large"})
+        except _Disconnected:
+            pass
+        finally:
+            if self.watcher is not None:
+                self.watcher.cancel()
+
+    async def _watch(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        self.disconnected.set()
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        environ["asgi.disconnected"] = self.disconnected
+        return environ
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run, thread_sensitive=False, executor=self.executor)(body)
+
+    def _run(self, body):
+        # the view and start_response on one executor thread, as asgiref does,
+        # and the iterable closed afterwards so a streaming view's cleanup runs
+        # even when the client has gone
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # too many duplicate headers
+            self.sync_send({"type": "http.response.start", "status": 400, "headers": []})
+            self.sync_send({"type": "http.response.body", "body": b"Bad Request"})
+            return
+        sent = 0
+        result = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in result:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # never send more than the Content-Length the view declared
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - sent]
+                self.sync_send({"type": "http.response.body", "body": output, "more_body": True})
+                sent += len(output)
+                if sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({"type": "http.response.body"})
+
+
+class _RoutedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        if path in STREAM_PATHS:
+            executor = _streams
+        elif path in FACE_PATHS:
+            executor = _faces
+        else:
+            executor = _pages
+        max_body = BODY_LIMITS.get(path, MAX_BODY)
+        await _Request(self.wsgi_application, executor, max_body)(scope, receive, send)
+
+
+_http = _RoutedWsgiToAsgi(voting_app.app)
+
+
+def _startup():
+    # migrating is `prepare`'s job, done once rather than raced by every worker
+    latest = migrations.MIGRATIONS[-1][0]
+    for path in voting_app.SHARD_PATHS:
+        conn = db.connect(path)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+        if version < latest:
+            raise RuntimeError(
+                f"{path} is at schema {version}, not {latest}; run `flask --app app prepare` first"
+            )
+    voting_app.build_face_index()
+
+
+async def _lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await loop.run_in_executor(_pages, _startup)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for pool in (_pages, _faces, _streams):
+                pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http":
+        await _http(scope, receive, send)
+    elif scope["type"] == "websocket":
+        # refused before the handshake completes, so the page falls back
+        await receive()
+        await send({"type": "websocket.close", "code": 1011})
+    elif scope["type"] == "lifespan":
+        await _lifespan(receive, send)
@@ -0,0 +1,120 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import db
+
+
+class BallotQueue:
+    # Write-behind ballot ingestion. Request threads enqueue a ballot and
+    # wait on its future; one writer thread commits whole batches in a
+    # single transaction and only then resolves the futures.
+    def __init__(self, path, max_batch=256, max_wait_ms=5, timeout=10):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        # how long cast waits for its batch before giving up with CONTENTION
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._conn = db.connect(path)
+        # an acknowledged ballot must survive power loss, so fsync each batch
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        # (re)start the writer if it is not running, so a crash in it costs
+        # the ballots of one batch rather than every ballot after it
+        with self._lock:
+            if self._closed or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="ballot-writer", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, voter_id, candidate):
+        self._ensure_writer()
+        future = Future()
+        self._queue.put((voter_id, candidate, future))
+        return future
+
+    def cast(self, voter_id, candidate, timeout=None):
+        future = self.submit(voter_id, candidate)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            # a ballot still queued is withdrawn and never written; one the
+            # writer already holds may land, and the retry then reports it
+            # as ALREADY_VOTED
+            future.cancel()
+            return db.CONTENTION
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._queue.put(None)
+        if thread is not None:
+            thread.join()
+        self._conn.close()
+
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            # ballots whose caller gave up are dropped here
+            batch = [b for b in batch if b[2].set_running_or_notify_cancel()]
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        conn = self._conn
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            election_id = db.current_election(conn)
+            for voter_id, candidate, _ in batch:
+                # a ballot that fails rolls back to its own savepoint and
+                # takes nothing else in the batch with it
+                conn.execute("SAVEPOINT ballot")
+                try:
+                    results.append((db.record_ballot(conn, voter_id, candidate, election_id), None))
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    conn.execute("ROLLBACK TO ballot")
+                    results.append((None, e))
+                conn.execute("RELEASE ballot")
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            results = [(db.CONTENTION, None)] * len(batch)
+        except Exception as e:
+            conn.rollback()
+            results = [(None, e)] * len(batch)
+
+        for (_, _, future), (outcome, error) in zip(batch, results):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(outcome)
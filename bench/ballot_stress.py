@@ -0,0 +1,78 @@
+# Stress db.cast_ballot: many threads race for the same voters and for
+# distinct voters, then the ledger is checked for double votes.
+#
+#   python -m bench.ballot_stress --threads 32 --voters 500 --attempts 8
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+
+import db
+from app import init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ballot casting stress test")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--voters", type=int, default=500)
+    parser.add_argument("--attempts", type=int, default=8,
+                        help="ballots each thread tries to cast for every voter")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="ballot_stress_"), "stress.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO voters (aadhaar_hash, mobile) VALUES (?, ?)",
+        ((f"stress{i}", "9999999999") for i in range(args.voters))
+    )
+    conn.commit()
+    conn.close()
+
+    pool = db.ConnectionPool(path, args.threads)
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(n):
+        # half the threads fight over voter 1, the rest sweep the whole roll
+        ids = [1] * args.attempts if n % 2 else list(range(1, args.voters + 1))
+        local = Counter()
+        conn = pool.acquire()
+        barrier.wait()
+        try:
+            for voter_id in ids:
+                local[db.cast_ballot(conn, voter_id, f"cand{n % 4}")] += 1
+        finally:
+            pool.release(conn)
+        with lock:
+            outcomes.update(local)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    pool.close()
+
+    conn = sqlite3.connect(path)
+    votes = conn.execute("SELECT COUNT(*) FROM votes").fetchone()[0]
+    doubles = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT voter_id FROM votes "
+        "GROUP BY election_id, voter_id HAVING COUNT(*) > 1)"
+    ).fetchone()[0]
+    voted = conn.execute("SELECT COUNT(*) FROM turnout").fetchone()[0]
+    conn.close()
+
+    print(dict(outcomes), f"votes={votes} voted={voted} doubles={doubles}")
+    if doubles or votes != voted or outcomes[db.CAST] != votes:
+        raise SystemExit("Ballot ledger is inconsistent")
+    if outcomes[db.CONTENTION] == 0 and votes != args.voters:
+        raise SystemExit("Voters were left without a ballot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import glob
+import json
+import os
+import time
+
+import cv2
+
+RESOLUTIONS = {
+    "480p": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+}
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_fixtures(fixture_dir, flags=cv2.IMREAD_GRAYSCALE):
+    paths = sorted(
+        p for p in glob.glob(os.path.join(fixture_dir, "*"))
+        if p.lower().endswith(IMAGE_EXTS)
+    )
+    images = []
+    for path in paths:
+        img = cv2.imread(path, flags)
+        if img is not None:
+            images.append((os.path.basename(path), img))
+    if not images:
+        raise SystemExit(f"No readable images in {fixture_dir}")
+    return images
+
+
+def fit(img, size):
+    # letterbox a fixture into a camera-sized frame without distorting it
+    width, height = size
+    h, w = img.shape[:2]
+    scale = min(width / w, height / h)
+    resized = cv2.resize(img, (round(w * scale), round(h * scale)))
+    top = (height - resized.shape[0]) // 2
+    left = (width - resized.shape[1]) // 2
+    return cv2.copyMakeBorder(
+        resized, top, height - resized.shape[0] - top,
+        left, width - resized.shape[1] - left,
+        cv2.BORDER_CONSTANT, value=0
+    )
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples_ms):
+    return {
+        "n": len(samples_ms),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def write_json(report, path):
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,72 @@
+# Full-resolution vs downscaled Haar detection.
+#
+#   python -m bench.detect path/to/fixtures --width 640 --repeat 5
+#
+# Every fixture is letterboxed into 720p and 1080p frames and run through
+# locate_face() once at full resolution and once at the working width.
+
+import argparse
+
+from app import locate_face
+from bench.common import RESOLUTIONS, fit, load_fixtures, summarize, timed, write_json
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def run(fixtures, width, repeat):
+    report = {"detect_width": width, "fixtures": len(fixtures), "resolutions": {}}
+    for label in ("720p", "1080p"):
+        full_ms, small_ms = [], []
+        full_hits = small_hits = agree = 0
+        for _, img in fixtures:
+            frame = fit(img, RESOLUTIONS[label])
+            for _ in range(repeat):
+                full_box, ms = timed(locate_face, frame, 0)
+                full_ms.append(ms)
+                small_box, ms = timed(locate_face, frame, width)
+                small_ms.append(ms)
+            full_hits += full_box is not None
+            small_hits += small_box is not None
+            if full_box is None and small_box is None:
+                agree += 1
+            elif full_box and small_box and iou(full_box, small_box) >= 0.5:
+                agree += 1
+
+        full, small = summarize(full_ms), summarize(small_ms)
+        report["resolutions"][label] = {
+            "full": full,
+            "downscaled": small,
+            "speedup": round(full["p50_ms"] / small["p50_ms"], 2) if small["p50_ms"] else None,
+            "detection_rate_full": round(full_hits / len(fixtures), 3),
+            "detection_rate_downscaled": round(small_hits / len(fixtures), 3),
+            "box_agreement": round(agree / len(fixtures), 3),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-resolution vs downscaled Haar detection")
+    parser.add_argument("fixtures", help="directory of face images")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(load_fixtures(args.fixtures), args.width, args.repeat)
+    write_json(report, args.out)
+
+    rates = report["resolutions"].values()
+    if any(r["detection_rate_full"] != r["detection_rate_downscaled"] for r in rates):
+        raise SystemExit("Detection rate changed with downscaling")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# 1:N search latency of FaceIndex over a synthetic roll.
+#
+#   python -m bench.face_index --voters 300000 --queries 50
+
+import argparse
+
+import numpy as np
+
+from bench.common import summarize, timed, write_json
+from face_index import FaceIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FaceIndex 1:N search latency")
+    parser.add_argument("--voters", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = FaceIndex(capacity=args.voters)
+    for i in range(args.voters):
+        index.add(f"voter{i}", rng.integers(0, 256, (200, 200), dtype=np.uint8))
+
+    samples = []
+    for _ in range(args.queries):
+        probe = rng.integers(0, 256, (200, 200), dtype=np.uint8)
+        _, ms = timed(index.search, probe, args.top_k)
+        samples.append(ms)
+
+    write_json({"voters": len(index), "search": summarize(samples)}, args.out)
+
+
+if __name__ == "__main__":
+    main()
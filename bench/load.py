@@ -0,0 +1,341 @@
+# End-to-end load test of the voter flow: user_login -> user_otp ->
+# user_face_verify -> vote, with many simulated voters at once.
+#
+#   python -m bench.load path/to/fixtures --voters 500 --concurrency 32
+#   python -m bench.load path/to/fixtures --url http://127.0.0.1:5000 --db database.db
+#
+# Without --url the app is driven in-process through Flask's test client
+# against a throwaway database and face store. With --url a running server
+# is driven over HTTP; --db (and SHARDS) must name the database it uses so
+# the synthetic voters can be enrolled first, and the server should run
+# with DUPLICATE_PREFILTER=2 so voters sharing a fixture face are not
+# rejected as duplicates. The OTP is read back from the flash on /user_otp.
+#
+# --upload picks how frames are posted: a raw image/jpeg body (what the page
+# sends), a multipart form, or the older base64 data URL in JSON. --burst N
+# posts N frames per attempt, as the page does: N-1 motion-blurred copies
+# ahead of the sharp one, so the server's quality ranking has work to do.
+#
+# A face upload turned away with 503/429 is retried after its Retry-After,
+# as the page does, up to --face-retries times; voters still turned away
+# after that count as "face_shed".
+#
+# Reports voters per minute, per-route latency percentiles, and error and
+# "database is locked" rates as JSON, tagged with the git commit.
+
+import argparse
+import base64
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from flask import got_request_exception
+
+from bench.common import RESOLUTIONS, fit, load_fixtures, summarize, write_json
+
+CANDIDATES = ["Bharani", "Jai Akash", "Fayas", "Dhanush"]
+CONSTITUENCIES = ["north", "south", "east", "west"]
+OTP_RE = re.compile(r"OTP: (\d{6})")
+
+
+class Response:
+    def __init__(self, status, location, text, retry_after=None):
+        self.status = status
+        self.location = location
+        self.text = text
+        self.retry_after = retry_after
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AppClient:
+    # in-process, one cookie jar per simulated voter
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, form=None, body=None, data=None, content_type=None):
+        resp = self._client.open(
+            path, method=method, data=form if data is None else data,
+            json=body, content_type=content_type
+        )
+        return Response(resp.status_code, resp.headers.get("Location"),
+                        resp.get_data(as_text=True), resp.headers.get("Retry-After"))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.cookies = http.cookiejar.CookieJar()
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect
+        )
+
+    def request(self, method, path, form=None, body=None, data=None, content_type=None):
+        headers = {}
+        if data is not None:
+            headers["Content-Type"] = content_type
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data, headers, method=method)
+        try:
+            with self._opener.open(req) as resp:
+                return Response(resp.status, resp.headers.get("Location"), resp.read().decode())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.headers.get("Location"),
+                            e.read().decode(errors="replace"), e.headers.get("Retry-After"))
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.locked = 0
+        self.shed = 0
+        self.completed = 0
+        self.failures = {}
+
+    def timed(self, route, client, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = client.request(method, path, **kwargs)
+        except OSError:
+            resp = Response(0, None, "")
+        ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            if resp.status in (429, 503):
+                # kept apart so the admitted requests' percentiles stay readable
+                route += " [shed]"
+                self.shed += 1
+            elif resp.status == 0 or resp.status >= 500:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            self.latency.setdefault(route, []).append(ms)
+            if "database is locked" in resp.text:
+                self.locked += 1
+        return resp
+
+    def count_locked(self):
+        with self._lock:
+            self.locked += 1
+
+    def finish(self, outcome):
+        with self._lock:
+            if outcome == "voted":
+                self.completed += 1
+            else:
+                self.failures[outcome] = self.failures.get(outcome, 0) + 1
+
+
+def encode_frame(img, resolution, quality, upload, burst=1):
+    # request keyword arguments that post this frame the way --upload says
+    frame = fit(img, RESOLUTIONS[resolution])
+    shots = [cv2.blur(frame, (1, 9 + 4 * i)) for i in range(burst - 1, 0, -1)] + [frame]
+    jpegs = [
+        cv2.imencode(".jpg", shot, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        for shot in shots
+    ]
+    if upload == "jpeg" and burst == 1:
+        return {"data": jpegs[0], "content_type": "image/jpeg"}
+    if upload in ("jpeg", "multipart"):
+        boundary = "loadtest" + os.urandom(8).hex()
+        data = b"".join(
+            (
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"frame\"; "
+                f"filename=\"frame{i}.jpg\"\r\nContent-Type: image/jpeg\r\n\r\n"
+            ).encode() + jpeg + b"\r\n"
+            for i, jpeg in enumerate(jpegs)
+        ) + f"--{boundary}--\r\n".encode()
+        return {"data": data, "content_type": f"multipart/form-data; boundary={boundary}"}
+    urls = ["data:image/jpeg;base64," + base64.b64encode(jpeg).decode() for jpeg in jpegs]
+    return {"body": {"frames": urls} if burst > 1 else {"frame": urls[0]}}
+
+
+def run_voter(client, rec, aadhaar, mobile, frame, candidate, face_retries=3):
+    resp = rec.timed("POST /user_login", client, "POST", "/user_login",
+                     form={"aadhaar": aadhaar, "mobile": mobile})
+    if resp.status != 302:
+        return "login_failed"
+
+    resp = rec.timed("GET /user_otp", client, "GET", "/user_otp")
+    match = OTP_RE.search(resp.text)
+    if not match:
+        return "otp_missing"
+    resp = rec.timed("POST /user_otp", client, "POST", "/user_otp", form={"otp": match.group(1)})
+    if resp.status != 302 or not resp.location.endswith("/user_face"):
+        return "otp_rejected"
+
+    for _ in range(face_retries + 1):
+        resp = rec.timed("POST /user_face_verify", client, "POST", "/user_face_verify", **frame)
+        if resp.status not in (429, 503):
+            break
+        time.sleep(float(resp.retry_after or 1))
+    else:
+        return "face_shed"
+    if resp.status != 200:
+        return "face_error"
+    result = resp.json()
+    if not result.get("success"):
+        return f"face_rejected: {result.get('msg')}"
+
+    resp = rec.timed("POST /vote", client, "POST", "/vote", form={"candidate": candidate})
+    if resp.status != 302:
+        return "vote_error"
+    if resp.location.endswith("/vote"):
+        # CONTENTION: the ballot lost the race for the write lock
+        rec.count_locked()
+        return "vote_contention"
+    return "voted"
+
+
+def enroll_voters(db_path, shard_count, voters):
+    # voters are spread over the constituencies so every shard gets some
+    import db
+    import shards
+    from app import hash_aadhaar
+
+    paths = shards.shard_paths(db_path, shard_count)
+    conns = [db.connect(path) for path in paths]
+    by_shard = {}
+    for aadhaar, mobile, constituency in voters:
+        shard = shards.shard_for(constituency, shard_count)
+        by_shard.setdefault(shard, []).append((hash_aadhaar(aadhaar), mobile, constituency))
+    for shard, rows in by_shard.items():
+        conn = conns[shard]
+        conn.executemany(
+            "INSERT INTO voters (aadhaar_hash, mobile, constituency) VALUES (?, ?, ?)", rows
+        )
+        db.count_voters(conn, len(rows))
+        conn.commit()
+    for conn in conns:
+        conn.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end voter flow load test")
+    parser.add_argument("fixtures", help="directory of face images")
+    parser.add_argument("--voters", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="720p")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality of the frames")
+    parser.add_argument("--upload", choices=("jpeg", "multipart", "base64"), default="jpeg")
+    parser.add_argument("--burst", type=int, default=1, help="frames per verification attempt")
+    parser.add_argument("--face-retries", type=int, default=3)
+    parser.add_argument("--url", help="drive a running server instead of the app in-process")
+    parser.add_argument("--db", help="database the server at --url uses")
+    parser.add_argument("--seed", type=int, help="fixes the block of synthetic Aadhaar numbers")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    if args.url and not args.db:
+        parser.error("--url needs --db to enroll the synthetic voters")
+
+    if not args.url:
+        # app reads these at import time
+        workdir = tempfile.mkdtemp(prefix="bench_load_")
+        os.environ["DATABASE"] = os.path.join(workdir, "load.db")
+        os.environ["FACE_DIR"] = os.path.join(workdir, "faces")
+        os.environ.setdefault("DUPLICATE_PREFILTER", "2")
+
+    import app as voting_app
+
+    rng = random.Random(args.seed)
+    frames = [
+        encode_frame(img, args.resolution, args.quality, args.upload, args.burst)
+        for _, img in load_fixtures(args.fixtures)
+    ]
+    # a random block of Aadhaar numbers keeps repeated --url runs apart
+    base = rng.randrange(10 ** 11, 9 * 10 ** 11)
+    voters = [
+        (str(base + i), f"9{i:09d}"[-10:], CONSTITUENCIES[i % len(CONSTITUENCIES)])
+        for i in range(args.voters)
+    ]
+
+    db_path = args.db or voting_app.DATABASE
+    voting_app.init_db(db_path)
+    enroll_voters(db_path, voting_app.SHARDS, voters)
+
+    rec = Recorder()
+    if not args.url:
+        # in-process the lock errors surface as exceptions, not response text
+        def on_exception(sender, exception, **extra):
+            if "database is locked" in str(exception):
+                rec.count_locked()
+        got_request_exception.connect(on_exception, voting_app.app)
+
+    def simulate(i):
+        aadhaar, mobile, _ = voters[i]
+        client = HttpClient(args.url) if args.url else AppClient(voting_app.app)
+        outcome = run_voter(
+            client, rec, aadhaar, mobile,
+            frames[i % len(frames)], CANDIDATES[i % len(CANDIDATES)], args.face_retries
+        )
+        rec.finish(outcome)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(simulate, range(args.voters)))
+    elapsed = time.perf_counter() - start
+
+    requests = sum(len(samples) for samples in rec.latency.values())
+    errors = sum(rec.errors.values())
+    write_json({
+        "commit": git_commit(),
+        "target": args.url or "in-process",
+        "voters": args.voters,
+        "concurrency": args.concurrency,
+        "resolution": args.resolution,
+        "quality": args.quality,
+        "upload": args.upload,
+        "burst": args.burst,
+        "seconds": round(elapsed, 2),
+        "voters_per_min": round(rec.completed / elapsed * 60, 1) if elapsed else 0.0,
+        "completed": rec.completed,
+        "failures": rec.failures,
+        "requests": requests,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "shed": rec.shed,
+        "locked": rec.locked,
+        "locked_rate": round(rec.locked / requests, 4) if requests else 0.0,
+        "routes": {
+            route: dict(
+                summarize(samples),
+                errors=rec.errors.get(route, 0),
+                rps=round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            )
+            for route, samples in rec.latency.items()
+        },
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
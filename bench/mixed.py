@@ -0,0 +1,193 @@
+# Mixed traffic against the threaded server app.run uses and the ASGI entry
+# point, each started as a subprocess on a throwaway database:
+#
+#   python -m bench.mixed path/to/fixtures --seconds 20 --uploaders 32 --readers 8
+#
+# --uploaders voters log in and then keep posting face frames, each body
+# trickled out in --chunks pieces over --upload-ms to mimic a slow booth
+# network. Meanwhile --readers clients fetch the cheap pages (/, /user_login,
+# /admin_login) back to back. Reports, per server, the request rate and
+# latency percentiles of each class as JSON, tagged with the git commit.
+
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+
+from bench.common import RESOLUTIONS, fit, load_fixtures, summarize, write_json
+from bench.load import CONSTITUENCIES, OTP_RE, HttpClient, enroll_voters, git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ["/", "/user_login", "/admin_login"]
+SERVERS = {
+    "sync": [sys.executable, "-m", "flask", "--app", "app", "run", "--no-reload", "--port"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:application", "--log-level", "warning", "--port"],
+}
+
+
+def start_server(kind, port, workdir):
+    env = dict(
+        os.environ,
+        DATABASE=os.path.join(workdir, "mixed.db"),
+        FACE_DIR=os.path.join(workdir, "faces"),
+        DUPLICATE_PREFILTER="2",
+    )
+    proc = subprocess.Popen(
+        SERVERS[kind] + [str(port)], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return proc
+        except (OSError, urllib.error.URLError):
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit(f"{kind} server did not come up on port {port}")
+
+
+def sign_in(base_url, aadhaar, mobile):
+    # session cookie header for a voter who got past the OTP, or None
+    client = HttpClient(base_url)
+    client.request("POST", "/user_login", form={"aadhaar": aadhaar, "mobile": mobile})
+    match = OTP_RE.search(client.request("GET", "/user_otp").text)
+    if not match:
+        return None
+    client.request("POST", "/user_otp", form={"otp": match.group(1)})
+    return "; ".join(f"{c.name}={c.value}" for c in client.cookies)
+
+
+def slow_upload(port, cookie, jpeg, chunks, upload_ms):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.putrequest("POST", "/user_face_verify")
+        conn.putheader("Content-Type", "image/jpeg")
+        conn.putheader("Content-Length", str(len(jpeg)))
+        conn.putheader("Cookie", cookie)
+        conn.endheaders()
+        step = -(-len(jpeg) // chunks)
+        for i in range(0, len(jpeg), step):
+            conn.send(jpeg[i:i + step])
+            time.sleep(upload_ms / 1000 / chunks)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def run_server(kind, port, frames, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_mixed_{kind}_")
+    db_path = os.path.join(workdir, "mixed.db")
+    voters = [
+        (str(10 ** 11 + i), f"9{i:09d}"[-10:], CONSTITUENCIES[i % len(CONSTITUENCIES)])
+        for i in range(args.uploaders)
+    ]
+    import app as voting_app
+    voting_app.init_db(db_path)
+    enroll_voters(db_path, voting_app.SHARDS, voters)
+
+    proc = start_server(kind, port, workdir)
+    base_url = f"http://127.0.0.1:{port}"
+    latency = {"face": [], "pages": []}
+    errors = {"face": 0, "pages": 0}
+    lock = threading.Lock()
+    try:
+        cookies = [sign_in(base_url, aadhaar, mobile) for aadhaar, mobile, _ in voters]
+        stop = time.time() + args.seconds
+
+        def record(kind, ms, ok):
+            with lock:
+                latency[kind].append(ms)
+                errors[kind] += not ok
+
+        def uploader(i):
+            while time.time() < stop:
+                start = time.perf_counter()
+                try:
+                    ok = slow_upload(port, cookies[i], frames[i % len(frames)],
+                                     args.chunks, args.upload_ms) == 200
+                except OSError:
+                    ok = False
+                record("face", (time.perf_counter() - start) * 1000, ok)
+
+        def reader(i):
+            n = i
+            while time.time() < stop:
+                start = time.perf_counter()
+                try:
+                    urllib.request.urlopen(base_url + PAGES[n % len(PAGES)], timeout=60).read()
+                    ok = True
+                except (OSError, urllib.error.URLError):
+                    ok = False
+                record("pages", (time.perf_counter() - start) * 1000, ok)
+                n += 1
+
+        threads = [threading.Thread(target=uploader, args=(i,)) for i in range(args.uploaders)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        name: dict(
+            summarize(samples),
+            errors=errors[name],
+            rps=round(len(samples) / elapsed, 1),
+        )
+        for name, samples in latency.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-traffic sync vs ASGI comparison")
+    parser.add_argument("fixtures", help="directory of face images")
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=["sync", "asgi"])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--uploaders", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=8, help="pieces each upload is sent in")
+    parser.add_argument("--upload-ms", type=float, default=1000, help="time spent sending each upload")
+    parser.add_argument("--resolution", choices=sorted(RESOLUTIONS), default="480p")
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    frames = [
+        cv2.imencode(".jpg", fit(img, RESOLUTIONS[args.resolution]),
+                     [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+        for _, img in load_fixtures(args.fixtures)
+    ]
+    write_json({
+        "commit": git_commit(),
+        "seconds": args.seconds,
+        "uploaders": args.uploaders,
+        "readers": args.readers,
+        "upload_ms": args.upload_ms,
+        "resolution": args.resolution,
+        "servers": {
+            kind: run_server(kind, args.port + i, frames, args)
+            for i, kind in enumerate(args.servers)
+        },
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Per-stage cost of the face pipeline: base64 decode, JPEG decode, Haar
+# detection, feature extraction and matching, over a fixture corpus at
+# several resolutions and JPEG qualities. rank_burst is the quality ranking
+# run over a three-frame burst before detection; track_window is a streaming
+# session's per-frame search around an already found face.
+#
+#   python -m bench.pipeline path/to/fixtures --qualities 60 80 95 --out base.json
+#   python -m bench.pipeline path/to/fixtures --baseline base.json --max-regression 10
+#
+# match_template is app.verify_face's backend (matchTemplate on equalized
+# crops); match_histogram is the calcHist/compareHist variant from
+# tempCodeRunnerFile.py. Both get a fresh live sample per call against a
+# cached enrolled one, as verify_face does. Each stage is timed on its own,
+# then run once more under tracemalloc for its peak and retained memory.
+# With --baseline the run fails if any stage's p50 got slower by more than
+# --max-regression percent (and by at least --min-delta-ms).
+
+import argparse
+import base64
+import json
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from app import decode_base64_image, detect_face, track_boxes
+from bench.common import RESOLUTIONS, fit, load_fixtures, summarize, timed, write_json
+from face_store import FaceSample
+from face_tracker import FaceTracker
+from frame_quality import rank_frames
+from matchers import get_matcher
+
+MATCHERS = {
+    "match_template": get_matcher("template"),
+    "match_histogram": get_matcher("histogram"),
+}
+
+
+def data_url(frame, quality):
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return "data:image/jpeg;base64," + base64.b64encode(buf.tobytes()).decode()
+
+
+def b64_decode(url):
+    return base64.b64decode(url.split(",", 1)[1])
+
+
+def jpeg_decode(jpeg):
+    return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def features(face):
+    sample = FaceSample(face)
+    return sample.equalized, sample.hist
+
+
+def memory(fn, *args):
+    # (peak KB, retained KB) of one call
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return round((peak - before) / 1024, 1), round((current - before) / 1024, 1)
+
+
+def stages_for(url):
+    # (stage, fn, args) in pipeline order; detection-dependent stages are
+    # only added once a face was found
+    jpeg = b64_decode(url)
+    gray = jpeg_decode(jpeg)
+    stages = [
+        ("b64_decode", b64_decode, (url,)),
+        ("jpeg_decode", jpeg_decode, (jpeg,)),
+        ("decode_base64_image", decode_base64_image, (url,)),
+        ("rank_burst", rank_frames, ([cv2.blur(gray, (1, 13)), cv2.blur(gray, (1, 9)), gray],)),
+        ("detect", detect_face, (gray,)),
+    ]
+    face = detect_face(gray)
+    if face is not None:
+        # enrolled features are computed once up front, as TemplateCache keeps them
+        enrolled = FaceSample(face)
+        _ = enrolled.equalized, enrolled.hist
+        stages.append(("features", features, (face,)))
+        tracker = FaceTracker(track_boxes)
+        if tracker.update(gray) is not None:
+            stages.append(("track_window", tracker.update, (gray,)))
+        for name, matcher in MATCHERS.items():
+            stages.append((name, lambda f, m=matcher: m.match(enrolled, FaceSample(f)), (face,)))
+    return stages, face is not None
+
+
+def run(fixtures, resolutions, qualities, repeat):
+    report = {"fixtures": len(fixtures), "repeat": repeat, "results": {}}
+    for label in resolutions:
+        frames = [fit(img, RESOLUTIONS[label]) for _, img in fixtures]
+        for quality in qualities:
+            times, peaks, retained, detected = {}, {}, {}, 0
+            for frame in frames:
+                stages, found = stages_for(data_url(frame, quality))
+                detected += found
+                for name, fn, args in stages:
+                    for _ in range(repeat):
+                        _, ms = timed(fn, *args)
+                        times.setdefault(name, []).append(ms)
+                    peak, kept = memory(fn, *args)
+                    peaks.setdefault(name, []).append(peak)
+                    retained.setdefault(name, []).append(kept)
+
+            report["results"][f"{label}/q{quality}"] = {
+                "detection_rate": round(detected / len(frames), 3),
+                "stages": {
+                    name: dict(
+                        summarize(samples),
+                        peak_kb=max(peaks[name]),
+                        retained_kb=max(retained[name]),
+                    )
+                    for name, samples in times.items()
+                },
+            }
+    return report
+
+
+def regressions(report, baseline, max_pct, min_delta_ms):
+    # every (config, stage) whose p50 grew by more than max_pct percent;
+    # changes under min_delta_ms are timer noise on the sub-millisecond stages
+    slower = []
+    for config, result in report["results"].items():
+        old = baseline.get("results", {}).get(config, {}).get("stages", {})
+        for stage, stats in result["stages"].items():
+            before = old.get(stage, {}).get("p50_ms")
+            if not before:
+                continue
+            change = (stats["p50_ms"] - before) / before * 100
+            if change > max_pct and stats["p50_ms"] - before >= min_delta_ms:
+                slower.append(f"{config} {stage}: {before:.3f} -> {stats['p50_ms']:.3f} ms (+{change:.0f}%)")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face pipeline stage benchmarks")
+    parser.add_argument("fixtures", help="directory of face images")
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS),
+                        default=["480p", "720p", "1080p"])
+    parser.add_argument("--qualities", nargs="+", type=int, default=[60, 80, 95])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="earlier --out report to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="allowed p50 slowdown per stage, in percent")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1,
+                        help="ignore p50 changes smaller than this")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(load_fixtures(args.fixtures), args.resolutions, args.qualities, args.repeat)
+    write_json(report, args.out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.max_regression, args.min_delta_ms)
+        if slower:
+            raise SystemExit("Stages regressed:\n" + "\n".join(slower))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# Concurrent vote throughput: connect-per-request in rollback-journal mode
+# (the old get_db), pooled WAL connections from db.py with the old
+# three-statement vote, pooled connections with db.cast_ballot, and the
+# group-commit BallotQueue.
+#
+#   python -m bench.votes --threads 16 --voters 2000 --readers 2
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import db
+from app import init_db
+from ballot_queue import BallotQueue
+from bench.common import summarize, write_json
+
+CANDIDATES = ["Bharani", "Jai Akash", "Fayas", "Dhanush"]
+
+
+def setup(path, voters, wal):
+    init_db(path)
+    conn = sqlite3.connect(path)
+    if not wal:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executemany(
+        "INSERT INTO voters (aadhaar_hash, mobile) VALUES (?, ?)",
+        ((f"bench{i}", "9999999999") for i in range(voters))
+    )
+    conn.commit()
+    conn.close()
+
+
+def cast(conn, voter_id, candidate):
+    voter = conn.execute(
+        'SELECT has_voted FROM voters WHERE id = ?', (voter_id,)
+    ).fetchone()
+    if voter and voter[0] == 0:
+        conn.execute(
+            'INSERT INTO votes (voter_id, candidate, timestamp) VALUES (?, ?, ?)',
+            (voter_id, candidate, datetime.now().isoformat())
+        )
+        conn.execute(
+            'UPDATE voters SET has_voted = 1 WHERE id = ?', (voter_id,)
+        )
+        conn.commit()
+
+
+def read_results(conn):
+    conn.execute('SELECT COUNT(*) FROM voters').fetchone()
+    conn.execute('SELECT COUNT(*) FROM votes').fetchone()
+    conn.execute(
+        'SELECT candidate, COUNT(*) FROM votes GROUP BY candidate'
+    ).fetchall()
+
+
+class Legacy:
+    def __init__(self, path):
+        self.path = path
+
+    def acquire(self):
+        return sqlite3.connect(self.path)
+
+    def release(self, conn):
+        conn.close()
+
+
+def run(mode, args):
+    workdir = tempfile.mkdtemp(prefix="bench_votes_")
+    path = os.path.join(workdir, "bench.db")
+    pooled = mode != "legacy"
+    setup(path, args.voters, wal=pooled)
+    pool = db.ConnectionPool(path, args.threads + args.readers) if pooled else Legacy(path)
+    cast_fn = db.cast_ballot if mode == "atomic" else cast
+    if mode == "group":
+        ballots = BallotQueue(path, args.batch_size, args.batch_wait_ms)
+        cast_fn = lambda conn, voter_id, candidate: ballots.cast(voter_id, candidate)
+
+    latencies, errors, locked = [], [0], [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def voter_worker(ids):
+        for voter_id in ids:
+            start = time.perf_counter()
+            conn = pool.acquire()
+            try:
+                outcome = cast_fn(conn, voter_id, CANDIDATES[voter_id % len(CANDIDATES)])
+                if outcome == db.CONTENTION:
+                    with lock:
+                        errors[0] += 1
+                        locked[0] += 1
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors[0] += 1
+                    locked[0] += "locked" in str(e)
+            finally:
+                pool.release(conn)
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    def reader_worker():
+        while not done.is_set():
+            conn = pool.acquire()
+            try:
+                read_results(conn)
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                pool.release(conn)
+
+    ids = list(range(1, args.voters + 1))
+    voters = [
+        threading.Thread(target=voter_worker, args=(ids[i::args.threads],))
+        for i in range(args.threads)
+    ]
+    readers = [threading.Thread(target=reader_worker) for _ in range(args.readers)]
+
+    start = time.perf_counter()
+    for t in readers + voters:
+        t.start()
+    for t in voters:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    for t in readers:
+        t.join()
+    if pooled:
+        pool.close()
+    if mode == "group":
+        ballots.shutdown()
+
+    return {
+        "votes_per_sec": round(args.voters / elapsed, 1),
+        "errors": errors[0],
+        "locked": locked[0],
+        "latency": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent vote throughput")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--voters", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--batch-wait-ms", type=float, default=5)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    write_json({mode: run(mode, args) for mode in ("legacy", "pooled", "atomic", "group")}, args.out)
+
+
+if __name__ == "__main__":
+    main()
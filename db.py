@@ -0,0 +1,258 @@
+import queue
+import sqlite3
+from datetime import datetime
+
+from flask import current_app, g
+
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16000
+
+
+def connect(path, busy_timeout_ms=BUSY_TIMEOUT_MS, cache_size_kb=CACHE_SIZE_KB):
+    # pooled connections move between request threads, one at a time
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL lets /results readers run alongside /vote writers; it is stored
+    # in the file, so this is a no-op after the first connection
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path, size=8, **options):
+        self.path = path
+        self.options = options
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, **self.options)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# ----------------------------
+# HOT SQL
+# ----------------------------
+# The statements on the request paths live in constants like these, here
+# and in import_voters.py and archive.py, so migrations.HOT_QUERIES checks
+# the plans of the very text the code runs.
+FIND_ADMIN = "SELECT * FROM admin WHERE username=?"
+FIND_VOTER = "SELECT * FROM voters WHERE aadhaar_hash=? AND mobile=?"
+VOTER_EXISTS = "SELECT 1 FROM voters WHERE aadhaar_hash = ?"
+INSERT_VOTER = 'INSERT INTO voters (aadhaar_hash, mobile, constituency) VALUES (?, ?, ?)'
+
+
+# ----------------------------
+# TALLIES
+# ----------------------------
+# Running counts kept in the same transaction as every voter/vote insert,
+# so /results never has to scan the votes table.
+COUNT_CANDIDATE = (
+    'INSERT INTO election_tally (election_id, candidate, votes) VALUES (?, ?, 1) '
+    'ON CONFLICT(election_id, candidate) DO UPDATE SET votes = votes + 1'
+)
+COUNT_ELECTION = 'UPDATE elections SET votes = votes + 1 WHERE id = ?'
+READ_VOTERS = "SELECT value FROM counters WHERE name = 'voters'"
+READ_VOTES = 'SELECT votes FROM elections WHERE id = ?'
+READ_CANDIDATES = (
+    'SELECT candidate, votes FROM election_tally '
+    'WHERE election_id = ? AND votes > 0 ORDER BY votes DESC'
+)
+LIVE_ELECTIONS = 'SELECT id FROM elections WHERE archived_to IS NULL'
+RECOUNT_CANDIDATES = (
+    'SELECT election_id, candidate, COUNT(*) FROM votes '
+    f'WHERE election_id IN ({LIVE_ELECTIONS}) GROUP BY election_id, candidate'
+)
+STORED_CANDIDATES = (
+    'SELECT election_id, candidate, votes FROM election_tally '
+    f'WHERE election_id IN ({LIVE_ELECTIONS})'
+)
+
+
+def count_vote(conn, election_id, candidate):
+    conn.execute(COUNT_CANDIDATE, (election_id, candidate))
+    conn.execute(COUNT_ELECTION, (election_id,))
+
+
+def count_voters(conn, n=1):
+    conn.execute("UPDATE counters SET value = value + ? WHERE name = 'voters'", (n,))
+
+
+def read_tallies(conn, election_id):
+    voters = conn.execute(READ_VOTERS).fetchone()
+    votes = conn.execute(READ_VOTES, (election_id,)).fetchone()
+    candidates = conn.execute(READ_CANDIDATES, (election_id,)).fetchall()
+    return voters[0] if voters else 0, votes[0] if votes else 0, candidates
+
+
+def check_tallies(conn, fix=False):
+    # Recount every election whose ballots are still in this database and
+    # return (name, stored, actual) for every counter that drifted.
+    # fix=True rewrites them under the write lock.
+    conn.execute("BEGIN IMMEDIATE" if fix else "BEGIN")
+    try:
+        actual = {}
+        for election_id, candidate, n in conn.execute(RECOUNT_CANDIDATES):
+            actual[f"{election_id}:candidate:{candidate}"] = n
+            actual[f"{election_id}:votes"] = actual.get(f"{election_id}:votes", 0) + n
+        actual['voters'] = conn.execute('SELECT COUNT(*) FROM voters').fetchone()[0]
+
+        stored = {
+            f"{row[0]}:candidate:{row[1]}": row[2]
+            for row in conn.execute(STORED_CANDIDATES)
+        }
+        stored.update(
+            (f"{row[0]}:votes", row[1]) for row in conn.execute(
+                'SELECT id, votes FROM elections WHERE archived_to IS NULL'
+            )
+        )
+        stored.update(conn.execute('SELECT name, value FROM counters').fetchall())
+
+        drift = [
+            (name, stored.get(name, 0), actual.get(name, 0))
+            for name in sorted(set(stored) | set(actual))
+            if stored.get(name, 0) != actual.get(name, 0)
+        ]
+
+        if fix and drift:
+            conn.execute(f'DELETE FROM election_tally WHERE election_id IN ({LIVE_ELECTIONS})')
+            conn.execute(f'INSERT INTO election_tally {RECOUNT_CANDIDATES}')
+            conn.execute(
+                'UPDATE elections SET votes = '
+                '(SELECT COUNT(*) FROM votes WHERE election_id = elections.id) '
+                'WHERE archived_to IS NULL'
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO counters VALUES ('voters', ?)", (actual['voters'],)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return drift
+
+
+# ----------------------------
+# ELECTIONS
+# ----------------------------
+# Ballots, turnout and tallies are keyed by election id, so starting a new
+# election is a single insert and earlier ones stay queryable until
+# archive.py moves them out. The newest election is the one being voted in.
+CURRENT_ELECTION = 'SELECT MAX(id) FROM elections'
+
+
+def current_election(conn):
+    return conn.execute(CURRENT_ELECTION).fetchone()[0]
+
+
+def start_election(conn, election_id=None):
+    # election_id lets shards.start_election give every shard the same id
+    cur = conn.execute(
+        'INSERT OR IGNORE INTO elections (id, started_at) VALUES (?, ?)',
+        (election_id, datetime.now().isoformat())
+    )
+    conn.commit()
+    return election_id or cur.lastrowid
+
+
+def list_elections(conn):
+    return conn.execute(
+        'SELECT id, started_at, votes, archived_to FROM elections ORDER BY id DESC'
+    ).fetchall()
+
+
+# ----------------------------
+# BALLOTS
+# ----------------------------
+CAST = "cast"
+ALREADY_VOTED = "already_voted"
+CONTENTION = "contention"
+
+CLAIM_TURNOUT = 'INSERT OR IGNORE INTO turnout (election_id, voter_id) VALUES (?, ?)'
+INSERT_VOTE = (
+    'INSERT INTO votes (election_id, voter_id, candidate, timestamp) VALUES (?, ?, ?, ?)'
+)
+
+
+def record_ballot(conn, voter_id, candidate, election_id=None):
+    # inside an open write transaction; the caller commits. The election is
+    # read under the same lock, so a ballot never lands in one that has
+    # just been superseded.
+    if election_id is None:
+        election_id = current_election(conn)
+    claimed = conn.execute(CLAIM_TURNOUT, (election_id, voter_id)).rowcount
+    if not claimed:
+        return ALREADY_VOTED
+    conn.execute(INSERT_VOTE, (election_id, voter_id, candidate, datetime.now().isoformat()))
+    count_vote(conn, election_id, candidate)
+    return CAST
+
+
+def cast_ballot(conn, voter_id, candidate):
+    # Claim the voter and record the vote under one write lock, taken up
+    # front so the transaction never has to upgrade from a read lock
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+        return CONTENTION
+
+    try:
+        outcome = record_ballot(conn, voter_id, candidate)
+        if outcome == CAST:
+            conn.commit()
+        else:
+            conn.rollback()
+    except sqlite3.OperationalError:
+        conn.rollback()
+        return CONTENTION
+    except Exception:
+        conn.rollback()
+        raise
+    return outcome
+
+
+# ----------------------------
+# FLASK INTEGRATION
+# ----------------------------
+def init_app(app, paths, pool_size=8):
+    # one pool per shard file; shard 0 is the main database
+    app.extensions["db_pools"] = [ConnectionPool(path, pool_size) for path in paths]
+    app.teardown_appcontext(close_db)
+
+
+def get_db(shard=0):
+    # one connection per shard per request, handed back to the pool on teardown
+    if "db" not in g:
+        g.db = {}
+    if shard not in g.db:
+        g.db[shard] = current_app.extensions["db_pools"][shard].acquire()
+    return g.db[shard]
+
+
+def get_shards():
+    return [get_db(shard) for shard in range(len(current_app.extensions["db_pools"]))]
+
+
+def close_db(exc=None):
+    pools = current_app.extensions["db_pools"]
+    for shard, conn in g.pop("db", {}).items():
+        pools[shard].release(conn)
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+# each worker thread/process owns its own classifier
+_local = threading.local()
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def _init_worker(cascade_path):
+    _local.cascade = cv2.CascadeClassifier(cascade_path)
+
+
+def _detect(gray, scale_factor, min_neighbors, min_size, max_size):
+    faces = _local.cascade.detectMultiScale(
+        gray, scale_factor, min_neighbors, minSize=min_size, maxSize=max_size
+    )
+    return [tuple(int(v) for v in box) for box in faces]
+
+
+class DetectorPool:
+    def __init__(self, workers=2, queue_size=8, mode="thread",
+                 cascade_path=CASCADE_PATH):
+        if mode == "process":
+            executor_cls = ProcessPoolExecutor
+        elif mode == "thread":
+            executor_cls = ThreadPoolExecutor
+        else:
+            raise ValueError(f"Unknown detector pool mode: {mode}")
+
+        self.workers = workers
+        self.queue_size = queue_size
+        # running + waiting frames; anything beyond this is refused
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = executor_cls(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(cascade_path,)
+        )
+
+    def submit(self, gray, scale_factor=1.2, min_neighbors=6,
+               min_size=(80, 80), max_size=(0, 0), timeout=None):
+        if timeout is None:
+            acquired = self._slots.acquire(blocking=False)
+        else:
+            acquired = self._slots.acquire(timeout=timeout)
+        if not acquired:
+            raise PoolBusy("Face detector is busy")
+
+        try:
+            future = self._executor.submit(
+                _detect, gray, scale_factor, min_neighbors, min_size, max_size
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def detect(self, gray, timeout=None, **params):
+        return self.submit(gray, timeout=timeout, **params).result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
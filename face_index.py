@@ -0,0 +1,72 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Templates are shrunk to VECTOR_SIDE x VECTOR_SIDE before indexing: 4 KB of
+# float32 per voter, so about 1.2 GB for 300k voters. Growing by doubling
+# briefly holds both copies; reserve() sizes the matrix once up front.
+VECTOR_SIDE = 32
+
+
+def to_vector(template, side=VECTOR_SIDE):
+    small = cv2.resize(template, (side, side), interpolation=cv2.INTER_AREA)
+    vec = small.astype(np.float32).ravel()
+    vec -= vec.mean()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class FaceIndex:
+    # Every enrolled template as one row of mean-centred, unit-length vectors,
+    # so a dot product is the same normalized correlation matchTemplate computes.
+    def __init__(self, side=VECTOR_SIDE, capacity=1024):
+        self.side = side
+        self._matrix = np.zeros((capacity, side * side), dtype=np.float32)
+        self._keys = []
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def reserve(self, capacity):
+        with self._lock:
+            if capacity > len(self._matrix):
+                grown = np.zeros((capacity, self._matrix.shape[1]), dtype=np.float32)
+                grown[:len(self._keys)] = self._matrix[:len(self._keys)]
+                self._matrix = grown
+
+    def add(self, key, template):
+        vec = to_vector(template, self.side)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self._keys)
+                if row == len(self._matrix):
+                    grown = np.zeros((row * 2, self._matrix.shape[1]), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._keys.append(key)
+                self._rows[key] = row
+            self._matrix[row] = vec
+
+    def search(self, template, k=5, exclude=None):
+        vec = to_vector(template, self.side)
+        with self._lock:
+            matrix, keys = self._matrix, self._keys
+            n = len(keys)
+            skip = self._rows.get(exclude)
+        if n == 0:
+            return []
+
+        scores = matrix[:n] @ vec
+        if skip is not None:
+            scores[skip] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(keys[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
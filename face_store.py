@@ -0,0 +1,215 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+TEMPLATE_SIZE = (200, 200)
+ROW_BYTES = TEMPLATE_SIZE[0] * TEMPLATE_SIZE[1]
+
+
+class FaceSample:
+    # A 200x200 grayscale crop plus the features matchers derive from it,
+    # each computed on first use and then kept
+    __slots__ = ("raw", "_equalized", "_hist")
+
+    def __init__(self, gray):
+        if gray.shape[:2] != TEMPLATE_SIZE:
+            gray = cv2.resize(gray, TEMPLATE_SIZE)
+        self.raw = gray
+        self._equalized = None
+        self._hist = None
+
+    @property
+    def equalized(self):
+        if self._equalized is None:
+            self._equalized = cv2.equalizeHist(self.raw)
+        return self._equalized
+
+    @property
+    def hist(self):
+        if self._hist is None:
+            self._hist = cv2.calcHist([self.raw], [0], None, [256], [0, 256])
+        return self._hist
+
+
+class TemplateStore:
+    # Append-only N x 200 x 200 uint8 file of enrolled face crops plus a
+    # "key<TAB>row" index. Re-enrolling appends a new row and the latest
+    # index line wins. Rows are read zero-copy through np.memmap.
+    def __init__(self, face_dir, name="templates"):
+        self.data_path = os.path.join(face_dir, f"{name}.bin")
+        self.index_path = os.path.join(face_dir, f"{name}.idx")
+        self.lock_path = os.path.join(face_dir, f"{name}.lock")
+        self._enroll_lock = threading.Lock()
+        for path in (self.data_path, self.index_path):
+            open(path, "ab").close()
+
+        self._rows = {}
+        self._index_offset = 0
+        # kept open so an unchanged index costs one fstat, not a read
+        self._index = open(self.index_path, "rb")
+        self._mmap = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._refresh()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        with self._lock:
+            self._refresh()
+            return list(self._rows)
+
+    def get(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                # another worker may have enrolled it since we last looked
+                self._refresh()
+                row = self._rows.get(key)
+                if row is None:
+                    return None
+            return self._view(row)[row]
+
+    def current_row(self, key):
+        # the key's latest row, after picking up enrollments by other workers
+        with self._lock:
+            self._refresh()
+            return self._rows.get(key)
+
+    def row(self, row):
+        with self._lock:
+            return self._view(row)[row]
+
+    def append(self, key, face):
+        face = np.ascontiguousarray(cv2.resize(face, TEMPLATE_SIZE), dtype=np.uint8)
+        with self._lock, open(self.index_path, "ab") as index:
+            if fcntl:
+                fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                with open(self.data_path, "ab") as data:
+                    row = data.seek(0, os.SEEK_END) // ROW_BYTES
+                    data.write(face.tobytes())
+                    data.flush()
+                    os.fsync(data.fileno())
+                index.write(f"{key}\t{row}\n".encode())
+                index.flush()
+                os.fsync(index.fileno())
+            finally:
+                if fcntl:
+                    fcntl.flock(index, fcntl.LOCK_UN)
+            self._refresh()
+        return row
+
+    @contextmanager
+    def enrolling(self):
+        # Held across a duplicate check and the enrollment that follows it,
+        # so two first captures of one face, in any worker, cannot both pass
+        with self._enroll_lock, open(self.lock_path, "ab") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def import_jpegs(self, face_dir):
+        # one-off migration of the old faces/<key>.jpg layout
+        imported = 0
+        for name in sorted(os.listdir(face_dir)):
+            key, ext = os.path.splitext(name)
+            if ext.lower() != ".jpg" or key in self._rows:
+                continue
+            img = cv2.imread(os.path.join(face_dir, name), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            self.append(key, img)
+            imported += 1
+        return imported
+
+    def _refresh(self):
+        if os.fstat(self._index.fileno()).st_size <= self._index_offset:
+            return
+        self._index.seek(self._index_offset)
+        chunk = self._index.read()
+        # ignore a trailing line another process is still writing
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].decode().splitlines():
+            key, row = line.split("\t")
+            self._rows[key] = int(row)
+        self._index_offset += end
+
+    def _view(self, row):
+        if self._mmap is None or row >= len(self._mmap):
+            count = os.path.getsize(self.data_path) // ROW_BYTES
+            self._mmap = np.memmap(
+                self.data_path, dtype=np.uint8, mode="r",
+                shape=(count,) + TEMPLATE_SIZE
+            )
+        return self._mmap
+
+
+class TemplateCache:
+    # FaceSamples over a TemplateStore, so a hit costs no preprocessing.
+    # Least recently used entries are dropped past max_entries (~40 KB each).
+    # Each entry remembers its store row; a hit whose key has since been
+    # re-enrolled (by this worker or another) is reloaded.
+    def __init__(self, store, max_entries=4096):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        row = self.store.current_row(key)
+        if row is None:
+            self.invalidate(key)
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == row:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        sample = FaceSample(self.store.row(row))
+        self._put(key, row, sample)
+        return sample
+
+    def load(self, key):
+        # bypass the cache, e.g. when building an index over every face
+        face = self.store.get(key)
+        if face is None:
+            return None
+        return FaceSample(face)
+
+    def keys(self):
+        return self.store.keys()
+
+    def enroll(self, key, sample):
+        self.invalidate(key)
+        row = self.store.append(key, sample.raw)
+        self._put(key, row, sample)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _put(self, key, row, sample):
+        with self._lock:
+            self._entries[key] = (row, sample)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,104 @@
+import cv2
+
+# Once a face is found, later frames are only searched in a window MARGIN
+# face-widths around the last box, scaled so the face is about TRACK_WIDTH
+# pixels wide and scanned only at sizes near the last one.
+MARGIN = 0.5
+TRACK_WIDTH = 96
+SIZE_RANGE = (0.7, 1.4)
+# consecutive boxes overlapping at least MIN_IOU make a steady face
+MIN_IOU = 0.6
+STABLE_FRAMES = 3
+# frames the window may miss before falling back to a full-frame search
+MAX_MISSES = 2
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+class FaceTracker:
+    # Follows one face across a stream of grayscale frames. detect(gray,
+    # min_size, max_size) returns boxes as (x, y, w, h); it runs on the whole
+    # frame only until a face is found, then on the window around it.
+    def __init__(self, detect, margin=MARGIN, track_width=TRACK_WIDTH,
+                 min_iou=MIN_IOU, stable_frames=STABLE_FRAMES, max_misses=MAX_MISSES):
+        self.detect = detect
+        self.margin = margin
+        self.track_width = track_width
+        self.min_iou = min_iou
+        self.stable_frames = stable_frames
+        self.max_misses = max_misses
+        self.box = None
+        self.stable = 0
+        self.misses = 0
+        self.full_searches = 0
+        self.window_searches = 0
+
+    @property
+    def steady(self):
+        return self.stable >= self.stable_frames
+
+    def update(self, gray):
+        # the face box in this frame, or None
+        if self.box is None:
+            box = self._search(gray)
+        else:
+            box = self._track(gray)
+
+        if box is None:
+            self.stable = 0
+            self.misses += 1
+            if self.misses > self.max_misses:
+                self.box = None
+            return None
+
+        if self.box is not None and iou(box, self.box) >= self.min_iou:
+            self.stable += 1
+        else:
+            self.stable = 1
+        self.box = box
+        self.misses = 0
+        return box
+
+    def _search(self, gray):
+        self.full_searches += 1
+        # a face at arm's length is at least an eighth of the frame wide
+        side = max(24, gray.shape[1] // 8)
+        boxes = self.detect(gray, (side, side), (0, 0))
+        if not boxes:
+            return None
+        return max(boxes, key=lambda b: b[2] * b[3])
+
+    def _track(self, gray):
+        self.window_searches += 1
+        height, width = gray.shape[:2]
+        x, y, w, h = self.box
+        pad_x, pad_y = round(w * self.margin), round(h * self.margin)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+
+        window = gray[y0:y1, x0:x1]
+        scale = min(1.0, self.track_width / w)
+        if scale < 1.0:
+            window = cv2.resize(
+                window, (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        low, high = (round(w * scale * f) for f in SIZE_RANGE)
+        boxes = self.detect(window, (max(24, low), max(24, low)), (high, high))
+        if not boxes:
+            return None
+
+        boxes = [
+            (x0 + round(bx / scale), y0 + round(by / scale), round(bw / scale), round(bh / scale))
+            for bx, by, bw, bh in boxes
+        ]
+        return max(boxes, key=lambda b: iou(b, self.box))
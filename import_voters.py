@@ -0,0 +1,249 @@
+# Streaming bulk import of a voter roll.
+#
+#   python import_voters.py roll.csv --rejects roll.rejects.csv
+#
+# The roll is CSV with aadhaar,mobile[,constituency] columns or NDJSON with
+# the same keys. Rows are read in chunks, Aadhaar numbers are hashed across
+# worker processes, and each chunk is split by shard and inserted with
+# executemany in one transaction per shard together with that shard's
+# checkpoint, so an interrupted import resumes where the last committed
+# chunk ended. Duplicates and malformed rows go to the reject file instead
+# of aborting the run.
+
+import argparse
+import csv
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import sqlite3
+import time
+
+import db
+import shards
+
+CHUNK_SIZE = 10000
+# stay well under SQLite's host-parameter limit
+LOOKUP_BATCH = 500
+SAVE_PROGRESS = 'INSERT OR REPLACE INTO import_progress VALUES (?, ?)'
+READ_PROGRESS = 'SELECT rows_done FROM import_progress WHERE source = ?'
+
+
+def existing_hashes_sql(n):
+    return f"SELECT aadhaar_hash FROM voters WHERE aadhaar_hash IN ({','.join('?' * n)})"
+
+
+def source_key(path):
+    # identify a roll by its whole content so a re-upload of the same file
+    # resumes, and an edited one with the same size and head starts afresh
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(functools.partial(f.read, 1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return f"{digest.hexdigest()}:{size}"
+
+
+def read_rows(path, fmt=None):
+    # yields (line_no, aadhaar, mobile, constituency); aadhaar and mobile
+    # are None when missing, constituency is "" when the roll has none
+    if fmt is None:
+        fmt = "ndjson" if path.lower().endswith((".ndjson", ".jsonl")) else "csv"
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield (
+                    line_no,
+                    (row.get("aadhaar") or "").strip() or None,
+                    (row.get("mobile") or "").strip() or None,
+                    (row.get("constituency") or "").strip(),
+                )
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield line_no, None, None, ""
+                    continue
+                yield (
+                    line_no,
+                    str(row.get("aadhaar") or "") or None,
+                    str(row.get("mobile") or "") or None,
+                    str(row.get("constituency") or "").strip(),
+                )
+
+
+def _hash_chunk(hash_fn, rows):
+    return [
+        (line_no, hash_fn(aadhaar) if aadhaar else None, mobile, constituency)
+        for line_no, aadhaar, mobile, constituency in rows
+    ]
+
+
+def _chunks(rows, size):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _existing_hashes(conn, hashes):
+    found = set()
+    for i in range(0, len(hashes), LOOKUP_BATCH):
+        batch = hashes[i:i + LOOKUP_BATCH]
+        found.update(
+            row[0] for row in conn.execute(existing_hashes_sql(len(batch)), batch)
+        )
+    return found
+
+
+def _write_shard(conn, key, rows_done, rows, rejects):
+    # one shard's slice of a chunk; nothing is kept unless it all commits
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # re-checked under the lock in case a voter was added meanwhile
+        existing = _existing_hashes(conn, [h for _, h, _, _ in rows])
+        fresh = []
+        for line_no, aadhaar_hash, mobile, constituency in rows:
+            if aadhaar_hash in existing:
+                rejects.append((line_no, "duplicate aadhaar"))
+            else:
+                fresh.append((aadhaar_hash, mobile, constituency))
+
+        conn.executemany(db.INSERT_VOTER, fresh)
+        db.count_voters(conn, len(fresh))
+        conn.execute(SAVE_PROGRESS, (key, rows_done))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(fresh)
+
+
+def _write_chunk(conns, progress, key, rows_done, hashed):
+    # Returns (inserted, rejected rows). Each shard commits its slice with
+    # its own checkpoint; shards that already hold this chunk from an
+    # interrupted run are skipped.
+    end = rows_done + len(hashed)
+    pending = [shard for shard, done in enumerate(progress) if done < end]
+    # Aadhaar numbers are unique across shards, not just within one
+    others = set().union(*(
+        _existing_hashes(conn, [h for _, h, _, _ in hashed if h]) for conn in conns
+    ))
+
+    by_shard = {shard: [] for shard in pending}
+    seen, rejects = set(), []
+    for line_no, aadhaar_hash, mobile, constituency in hashed:
+        shard = shards.shard_for(constituency, len(conns))
+        if shard not in by_shard:
+            seen.add(aadhaar_hash)
+        elif not aadhaar_hash or not mobile:
+            rejects.append((line_no, "missing aadhaar or mobile"))
+        elif aadhaar_hash in seen or aadhaar_hash in others:
+            rejects.append((line_no, "duplicate aadhaar"))
+        else:
+            seen.add(aadhaar_hash)
+            by_shard[shard].append((line_no, aadhaar_hash, mobile, constituency))
+
+    inserted = 0
+    for shard, rows in by_shard.items():
+        inserted += _write_shard(conns[shard], key, end, rows, rejects)
+        progress[shard] = end
+    rejects.sort()
+    return inserted, rejects
+
+
+def run_import(db_paths, path, hash_fn, rejects_path=None, fmt=None,
+               chunk_size=CHUNK_SIZE, workers=None, progress=None, key=None):
+    if isinstance(db_paths, str):
+        db_paths = [db_paths]
+    # the import_progress checkpoints come with migrations.migrate
+    conns = [db.connect(db_path) for db_path in db_paths]
+
+    key = key or source_key(path)
+    shard_progress = []
+    for conn in conns:
+        row = conn.execute(READ_PROGRESS, (key,)).fetchone()
+        shard_progress.append(row[0] if row else 0)
+    skipped = min(shard_progress)
+    rows_done, inserted, rejected = skipped, 0, 0
+
+    rejects_path = rejects_path or f"{path}.rejects.csv"
+    rejects_file = open(rejects_path, "a" if skipped else "w", newline="")
+    rejects = csv.writer(rejects_file)
+    if rejects_file.tell() == 0:
+        rejects.writerow(["line", "reason"])
+
+    rows = itertools.islice(read_rows(path, fmt), skipped, None)
+    hash_chunk = functools.partial(_hash_chunk, hash_fn)
+    start = time.perf_counter()
+
+    pool = multiprocessing.Pool(workers) if workers != 0 else None
+    try:
+        chunks = _chunks(rows, chunk_size)
+        hashed_chunks = pool.imap(hash_chunk, chunks) if pool else map(hash_chunk, chunks)
+        for hashed in hashed_chunks:
+            added, chunk_rejects = _write_chunk(conns, shard_progress, key, rows_done, hashed)
+            rejects.writerows(chunk_rejects)
+            rejects_file.flush()
+            rows_done += len(hashed)
+            inserted += added
+            rejected += len(chunk_rejects)
+            if progress:
+                elapsed = time.perf_counter() - start
+                progress(rows_done, inserted, rejected, (rows_done - skipped) / elapsed if elapsed else 0.0)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        rejects_file.close()
+        for conn in conns:
+            conn.close()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows_done,
+        "resumed_from": skipped,
+        "inserted": inserted,
+        "rejected": rejected,
+        "rejects_path": rejects_path,
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round((rows_done - skipped) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main():
+    from app import DATABASE, SHARDS, hash_aadhaar, init_db
+
+    parser = argparse.ArgumentParser(description="Bulk import a voter roll")
+    parser.add_argument("roll", help="CSV (aadhaar,mobile[,constituency]) or NDJSON roll")
+    parser.add_argument("--db", default=DATABASE)
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument("--rejects", help="reject file (default: <roll>.rejects.csv)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, help="hashing processes (0 hashes inline)")
+    args = parser.parse_args()
+
+    init_db(args.db)
+
+    def progress(rows, inserted, rejected, rate):
+        print(f"{rows} rows  {inserted} inserted  {rejected} rejected  {rate:,.0f} rows/s", flush=True)
+
+    try:
+        stats = run_import(
+            shards.shard_paths(args.db, SHARDS), args.roll, hash_aadhaar, args.rejects, args.format,
+            args.chunk_size, args.workers, progress
+        )
+    except sqlite3.Error as e:
+        raise SystemExit(f"Import stopped: {e}. Run again to resume.")
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import db
+import shards
+
+
+def snapshot(fan_out, conns, election_id=None):
+    # merged over every shard; shard 0 says which election is running
+    if election_id is None:
+        election_id = db.current_election(conns[0])
+    voters_count, total_votes, candidates = shards.read_tallies(fan_out, conns, election_id)
+    results = []
+    for row in candidates:
+        pct = round((row['votes'] / total_votes * 100), 1) if total_votes else 0
+        results.append({
+            'candidate': row['candidate'],
+            'votes': row['votes'],
+            'pct': pct
+        })
+    return {
+        'election': election_id,
+        'voters_count': voters_count,
+        'total_votes': total_votes,
+        'results': results
+    }
+
+
+class ResultsFeed:
+    # One tally snapshot shared by every /results/stream client. Whichever
+    # client finds it older than `interval` refreshes it while the others
+    # wait, so the database sees at most one read per interval no matter how
+    # many dashboards are open, and none at all when nobody is watching.
+    # Each refresh reads every shard in parallel and merges the tallies.
+    def __init__(self, paths, interval=1.0):
+        self.paths = paths
+        self._fan_out = shards.FanOut(len(paths))
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._version = 0
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._conns = None
+
+    def wait(self, seen_version, timeout=15.0):
+        # Block until there is a snapshot newer than seen_version. Returns
+        # (version, snapshot), or (version, None) once timeout passes.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._version != seen_version:
+                    return self._version, self._snapshot
+                now = time.monotonic()
+                if now >= deadline:
+                    return self._version, None
+
+                due = self._fetched_at + self.interval
+                if now >= due and not self._refreshing:
+                    self._refresh()
+                    continue
+                wake = deadline if self._refreshing else min(deadline, due)
+                self._cond.wait(max(0.01, wake - now))
+
+    def _refresh(self):
+        # called with the condition held; the read itself runs without it
+        self._refreshing = True
+        self._cond.release()
+        latest = None
+        try:
+            if self._conns is None:
+                self._conns = [db.connect(path) for path in self.paths]
+            latest = snapshot(self._fan_out, self._conns)
+        finally:
+            self._cond.acquire()
+            self._refreshing = False
+            self._fetched_at = time.monotonic()
+            if latest is not None and latest != self._snapshot:
+                self._snapshot = latest
+                self._version += 1
+            self._cond.notify_all()
@@ -0,0 +1,87 @@
+import time
+from collections import namedtuple
+
+import cv2
+
+# score is on the backend's own scale, or None when a cascade's prefilter
+# turned the face away before the deciding backend ran
+MatchResult = namedtuple("MatchResult", "matched score latency_ms backend")
+
+MATCHERS = {}
+
+
+def register_matcher(name):
+    def decorator(cls):
+        cls.name = name
+        MATCHERS[name] = cls
+        return cls
+    return decorator
+
+
+def get_matcher(name, **options):
+    try:
+        cls = MATCHERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown face matcher: {name}") from None
+    return cls(**options)
+
+
+class Matcher:
+    # Backends compare two face_store.FaceSample objects
+    threshold = 0.0
+
+    def __init__(self, threshold=None):
+        if threshold is not None:
+            self.threshold = threshold
+
+    def score(self, enrolled, live):
+        raise NotImplementedError
+
+    def match(self, enrolled, live):
+        start = time.perf_counter()
+        score = float(self.score(enrolled, live))
+        latency_ms = (time.perf_counter() - start) * 1000
+        return MatchResult(score >= self.threshold, score, latency_ms, self.name)
+
+
+@register_matcher("template")
+class TemplateMatcher(Matcher):
+    threshold = 0.65
+
+    def score(self, enrolled, live):
+        return cv2.matchTemplate(
+            enrolled.equalized, live.equalized, cv2.TM_CCOEFF_NORMED
+        )[0][0]
+
+
+@register_matcher("histogram")
+class HistogramMatcher(Matcher):
+    threshold = 0.45
+
+    def score(self, enrolled, live):
+        return cv2.compareHist(enrolled.hist, live.hist, cv2.HISTCMP_CORREL)
+
+
+@register_matcher("cascade")
+class CascadeMatcher(Matcher):
+    # Cheap histogram correlation first; only faces that survive it pay
+    # for matchTemplate. reject_below should sit well under the histogram
+    # backend's own threshold so true matches are never dropped here.
+    def __init__(self, threshold=None, reject_below=0.2):
+        self.prefilter = HistogramMatcher(reject_below)
+        self.matcher = TemplateMatcher(threshold)
+        self.threshold = self.matcher.threshold
+
+    def match(self, enrolled, live):
+        # a prefilter rejection has no matchTemplate score to report, and
+        # its histogram correlation is not comparable with threshold
+        start = time.perf_counter()
+        result = self.prefilter.match(enrolled, live)
+        if not result.matched:
+            latency_ms = (time.perf_counter() - start) * 1000
+            return MatchResult(False, None, latency_ms, "cascade/prefilter")
+        result = self.matcher.match(enrolled, live)
+        latency_ms = (time.perf_counter() - start) * 1000
+        return MatchResult(
+            result.matched, result.score, latency_ms, f"cascade/{result.backend}"
+        )
@@ -0,0 +1,165 @@
+# Latency histograms and counters for the hot paths, served at /metrics in
+# the Prometheus text format. Off unless METRICS=1; when off, timers are a
+# shared no-op and counters return straight away, so the instrumented code
+# pays one attribute lookup and a call.
+#
+# Each worker process keeps its own numbers; scrape every worker.
+import os
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.environ.get("METRICS") == "1"
+
+# seconds; the face stages sit in the 1-100 ms range, SQLite well under it
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _Timer:
+    __slots__ = ("histogram", "key", "start")
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram._observe(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    def __init__(self, name, help, *labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def time(self, *values):
+        if not ENABLED:
+            return _NOOP
+        return _Timer(self, values)
+
+    def observe(self, seconds, *values):
+        if ENABLED:
+            self._observe(values, seconds)
+
+    def _observe(self, key, seconds):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts, then +Inf, then the running sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(counts) for key, counts in self._series.items()}
+        for key, counts in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                labels = _labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, *labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *values, n=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------
+# METRICS
+# ----------------------------
+FACE_STAGE = Histogram(
+    "face_stage_seconds", "Time spent in each stage of the face routes.", "stage"
+)
+DB_QUERY = Histogram(
+    "db_query_seconds", "Time spent in database calls, by route.", "route", "query"
+)
+DETECTIONS = Counter(
+    "face_detections_total", "Frames run through face detection.", "result"
+)
+BURST_DETECT = Counter(
+    "face_burst_frames_detected_total",
+    "Burst frames run through detection, by whether the burst found a face.",
+    "result"
+)
+STREAM_SEARCHES = Counter(
+    "face_stream_searches_total",
+    "Detector searches run by face streams that were accepted, by kind.",
+    "kind"
+)
+ADMISSION = Counter(
+    "face_admission_total", "Face uploads admitted or turned away, by outcome.", "outcome"
+)
+VOTES = Counter("votes_total", "Ballots submitted, by outcome.", "outcome")
+LOCK_RETRIES = Counter(
+    "db_lock_retries_total",
+    "Requests turned away because the write lock was busy; the client retries.",
+    "route"
+)
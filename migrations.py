@@ -0,0 +1,200 @@
+import hashlib
+from datetime import datetime
+
+import archive
+import db
+import import_voters
+
+# ----------------------------
+# MIGRATIONS
+# ----------------------------
+# Applied in order at startup; PRAGMA user_version records the last one.
+# Append new steps, never edit old ones, and keep their SQL here rather than
+# calling into modules whose schema moves on.
+def _baseline(conn):
+    # the stricter of the two schemas that had drifted apart; databases
+    # created by the older, looser schema keep their existing tables
+    conn.execute('''CREATE TABLE IF NOT EXISTS voters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        aadhaar_hash TEXT UNIQUE NOT NULL,
+        mobile TEXT NOT NULL,
+        has_voted INTEGER DEFAULT 0
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS votes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        voter_id INTEGER NOT NULL,
+        candidate TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY(voter_id) REFERENCES voters(id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS admin (
+        id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        password_hash TEXT NOT NULL
+    )''')
+    conn.execute(
+        "INSERT OR IGNORE INTO admin VALUES (1,'admin',?)",
+        (hashlib.sha256("admin123".encode()).hexdigest(),)
+    )
+
+
+def _tallies(conn):
+    # running per-candidate and total counts, seeded from the raw tables
+    conn.execute('''CREATE TABLE IF NOT EXISTS tally (
+        candidate TEXT PRIMARY KEY,
+        votes INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute(
+        "INSERT OR IGNORE INTO counters VALUES ('voters', (SELECT COUNT(*) FROM voters))"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO counters VALUES ('votes', (SELECT COUNT(*) FROM votes))"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO tally SELECT candidate, COUNT(*) FROM votes GROUP BY candidate"
+    )
+
+
+def _import_progress(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS import_progress (
+        source TEXT PRIMARY KEY,
+        rows_done INTEGER NOT NULL DEFAULT 0
+    )''')
+
+
+def _indexes(conn):
+    # voters(aadhaar_hash) already has the UNIQUE index, which serves the
+    # aadhaar_hash AND mobile login lookup. admin(username) is unique so the
+    # planner keeps using it even when ANALYZE sees a one-row table
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_votes_voter ON votes(voter_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_votes_candidate ON votes(candidate)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_admin_username ON admin(username)')
+
+
+def _elections(conn):
+    # Everything cast so far becomes election 1. The per-candidate tally and
+    # the 'votes' counter move onto the election, and turnout takes over
+    # from voters.has_voted, which is no longer written.
+    conn.execute('''CREATE TABLE IF NOT EXISTS elections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TEXT NOT NULL,
+        votes INTEGER NOT NULL DEFAULT 0,
+        archived_to TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS turnout (
+        election_id INTEGER NOT NULL,
+        voter_id INTEGER NOT NULL,
+        PRIMARY KEY (election_id, voter_id)
+    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS election_tally (
+        election_id INTEGER NOT NULL,
+        candidate TEXT NOT NULL,
+        votes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (election_id, candidate)
+    ) WITHOUT ROWID''')
+    conn.execute('ALTER TABLE votes ADD COLUMN election_id INTEGER NOT NULL DEFAULT 1')
+
+    conn.execute(
+        "INSERT INTO elections (id, started_at, votes) VALUES "
+        "(1, ?, (SELECT COUNT(*) FROM votes))",
+        (datetime.now().isoformat(),)
+    )
+    conn.execute('INSERT OR IGNORE INTO turnout SELECT 1, id FROM voters WHERE has_voted = 1')
+    conn.execute('INSERT OR IGNORE INTO turnout SELECT DISTINCT 1, voter_id FROM votes')
+    conn.execute('INSERT INTO election_tally SELECT 1, candidate, votes FROM tally')
+    conn.execute('DROP TABLE tally')
+    conn.execute("DELETE FROM counters WHERE name = 'votes'")
+
+    conn.execute('DROP INDEX IF EXISTS idx_votes_candidate')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_votes_election ON votes(election_id, candidate)'
+    )
+
+
+def _constituency(conn):
+    # the shard key; voters enrolled before sharding all stay on shard 0
+    conn.execute("ALTER TABLE voters ADD COLUMN constituency TEXT NOT NULL DEFAULT ''")
+
+
+MIGRATIONS = [
+    (1, _baseline),
+    (2, _tallies),
+    (3, _import_progress),
+    (4, _indexes),
+    (5, _elections),
+    (6, _constituency),
+]
+
+
+def migrate(conn):
+    applied = []
+    for version, step in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # re-read under the write lock in case another worker got here first
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    if applied:
+        conn.execute("ANALYZE")
+    return applied
+
+
+# ----------------------------
+# QUERY PLANS
+# ----------------------------
+# The SQL behind each route, taken from the constants the code itself runs
+# (migration steps above keep their own frozen copies). Every one must be
+# answered through an index; SMALL_TABLES hold one row per counter or
+# election and may be scanned.
+HOT_QUERIES = {
+    "admin_login": db.FIND_ADMIN,
+    "user_login": db.FIND_VOTER,
+    "add_voter.exists": db.VOTER_EXISTS,
+    "add_voter.insert": db.INSERT_VOTER,
+    "vote.election": db.CURRENT_ELECTION,
+    "vote.turnout": db.CLAIM_TURNOUT,
+    "vote.insert": db.INSERT_VOTE,
+    "vote.candidate_tally": db.COUNT_CANDIDATE,
+    "vote.election_tally": db.COUNT_ELECTION,
+    "results.voters": db.READ_VOTERS,
+    "results.votes": db.READ_VOTES,
+    "results.tally": db.READ_CANDIDATES,
+    "tallies.recount": db.RECOUNT_CANDIDATES,
+    "tallies.stored": db.STORED_CANDIDATES,
+    "import.existing": import_voters.existing_hashes_sql(import_voters.LOOKUP_BATCH),
+    "import.progress": import_voters.READ_PROGRESS,
+    "import.checkpoint": import_voters.SAVE_PROGRESS,
+}
+for _table, _key in archive.ARCHIVED_TABLES:
+    HOT_QUERIES[f"archive.copy.{_table}"] = archive.copy_sql(_table, _key)
+    HOT_QUERIES[f"archive.purge.{_table}"] = archive.purge_sql(_table, _key)
+
+SMALL_TABLES = {"counters", "elections"}
+
+
+def table_scans(conn, queries=HOT_QUERIES):
+    # returns {query name: [plan steps that read a whole table]}
+    scans = {}
+    for name, sql in queries.items():
+        params = [None] * sql.count("?")
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row[-1]
+            words = detail.replace("SCAN TABLE ", "SCAN ").split()
+            table = words[1].rpartition(".")[2] if len(words) > 1 else ""
+            if words[0] == "SCAN" and "USING" not in words and table not in SMALL_TABLES:
+                scans.setdefault(name, []).append(detail)
+    return scans
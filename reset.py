@@ -1,21 +1,22 @@
-import sqlite3
+import os
 
-# Connect to your database
-conn = sqlite3.connect('database.db')
-c = conn.cursor()
+import db
+import migrations
+import shards
 
-# Clear all votes
-c.execute('DELETE FROM votes')
-print("All votes deleted.")
+# Connect to every shard of your database
+paths = shards.shard_paths('database.db', int(os.environ.get("SHARDS", 1)))
+conns = [db.connect(path) for path in paths]
+for conn in conns:
+    migrations.migrate(conn)
 
-# Allow voters to vote again
-c.execute('UPDATE voters SET has_voted = 0')
-print("All voters reset to 'not voted'.")
+# Ballots are kept per election, so a fresh one is a single insert per
+# shard and the previous results stay on /results?election=<id>
+election_id = shards.start_election(conns)
+print(f"Election {election_id} started; earlier votes are kept.")
+print("Move old ones out with: flask --app app archive-election <id>")
 
-# Save changes
-conn.commit()
-print("Changes saved.")
-
-# Close connection
-conn.close()
-print("Done!")
\ No newline at end of file
+# Close connections
+for conn in conns:
+    conn.close()
+print("Done!")
@@ -0,0 +1,217 @@
+# Server-side sessions: the cookie carries only a random id, and the role,
+# OTP, voter id and verification flags stay on the server where they can be
+# expired, counted and revoked. Backends:
+#
+#   memory  a dict in this process; one worker only
+#   sqlite  a WAL database file every worker on the host shares
+#
+# Lookups are a dict hit or a primary-key probe. Expired entries are
+# dropped when read, and a full sweep piggybacks on writes at most once per
+# sweep interval, so no thread is needed.
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+import db
+
+SWEEP_INTERVAL = 60
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = sid is None
+        self.modified = False
+        self.retired = None
+
+    def regenerate(self):
+        # same data under a fresh id, so an id planted before login is worthless
+        if self.sid is not None:
+            self.retired = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class Store:
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._sweep_lock = threading.Lock()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep()
+        finally:
+            self._sweep_lock.release()
+
+
+class MemoryStore(Store):
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        super().__init__(sweep_interval)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        # (expires, payload), or None if missing or expired
+        entry = self._entries.get(sid)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self.delete(sid)
+            return None
+        return entry
+
+    def set(self, sid, payload, expires):
+        with self._lock:
+            self._entries[sid] = (expires, payload)
+        self._maybe_sweep()
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expires, _) in self._entries.items() if expires < now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+
+class SQLiteStore(Store):
+    def __init__(self, path, sweep_interval=SWEEP_INTERVAL, pool_size=8):
+        super().__init__(sweep_interval)
+        self.pool = db.ConnectionPool(path, pool_size)
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                expires REAL NOT NULL,
+                data TEXT NOT NULL
+            ) WITHOUT ROWID''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires)')
+
+    def _conn(self):
+        return _Pooled(self.pool)
+
+    def get(self, sid):
+        with self._conn() as conn:
+            row = conn.execute(
+                'SELECT expires, data FROM sessions WHERE sid = ?', (sid,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[0] < time.time():
+            self.delete(sid)
+            return None
+        return row[0], row[1]
+
+    def set(self, sid, payload, expires):
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, expires, data) VALUES (?, ?, ?)',
+                (sid, expires, payload)
+            )
+        self._maybe_sweep()
+
+    def delete(self, sid):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        with self._conn() as conn:
+            return conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),)).rowcount
+
+    def clear(self):
+        with self._conn() as conn:
+            return conn.execute('DELETE FROM sessions').rowcount
+
+
+class _Pooled:
+    # borrow a connection for one statement and commit it on the way back
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.conn.commit()
+        self.pool.release(self.conn)
+        return False
+
+
+def make_store(kind, path=None, sweep_interval=SWEEP_INTERVAL):
+    if kind == "memory":
+        return MemoryStore(sweep_interval)
+    if kind == "sqlite":
+        return SQLiteStore(path, sweep_interval)
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        entry = self.store.get(sid) if sid else None
+        if entry is None:
+            return ServerSession()
+        expires, payload = entry
+        return ServerSession(self.serializer.loads(payload), sid, expires)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.retired is not None:
+            self.store.delete(session.retired)
+            session.retired = None
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # written when changed, or once half its lifetime is used up
+        now = time.time()
+        if not session.modified and session.sid is not None and session.expires - now > self.ttl / 2:
+            return
+        issue = session.sid is None
+        if issue:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires = now + self.ttl
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), session.expires)
+        if issue:
+            response.vary.add("Cookie")
+            response.set_cookie(
+                name, session.sid, domain=domain, path=path,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
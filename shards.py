@@ -0,0 +1,114 @@
+# Voters, ballots and tallies partitioned across several SQLite files by
+# constituency, so booths in different constituencies never wait on the
+# same write lock. Shard 0 is DATABASE itself and also holds the admin
+# account; with one shard nothing changes on disk.
+#
+# The shard of a constituency is a hash of its name, so SHARDS has to stay
+# fixed once voters are enrolled.
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+
+def shard_paths(database, count=1):
+    if count <= 1:
+        return [database]
+    root, ext = os.path.splitext(database)
+    return [database] + [f"{root}.shard{i}{ext}" for i in range(1, count)]
+
+
+def shard_for(constituency, count):
+    if count <= 1:
+        return 0
+    return zlib.crc32((constituency or "").strip().lower().encode()) % count
+
+
+class FanOut:
+    # Runs one function against every shard's connection in parallel; SQLite
+    # releases the GIL while it reads, so the shards are queried at once.
+    def __init__(self, shards):
+        self._executor = (
+            ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard")
+            if shards > 1 else None
+        )
+
+    def map(self, fn, conns):
+        if self._executor is None or len(conns) == 1:
+            return [fn(conn) for conn in conns]
+        return list(self._executor.map(fn, conns))
+
+
+# ----------------------------
+# CROSS-SHARD QUERIES
+# ----------------------------
+def find_voter(fan_out, conns, aadhaar_hash, mobile):
+    # (voter row, shard) or (None, None); the UNIQUE index makes each probe
+    # a single lookup
+    found = fan_out.map(
+        lambda conn: conn.execute(
+            db.FIND_VOTER, (aadhaar_hash, mobile)
+        ).fetchone(),
+        conns
+    )
+    for shard, voter in enumerate(found):
+        if voter is not None:
+            return voter, shard
+    return None, None
+
+
+def is_enrolled(fan_out, conns, aadhaar_hash):
+    return any(fan_out.map(
+        lambda conn: conn.execute(
+            db.VOTER_EXISTS, (aadhaar_hash,)
+        ).fetchone() is not None,
+        conns
+    ))
+
+
+def read_tallies(fan_out, conns, election_id):
+    # merge every shard's running counts into one (voters, votes, candidates)
+    voters_count, total_votes, merged = 0, 0, {}
+    for voters, votes, candidates in fan_out.map(
+        lambda conn: db.read_tallies(conn, election_id), conns
+    ):
+        voters_count += voters
+        total_votes += votes
+        for row in candidates:
+            merged[row['candidate']] = merged.get(row['candidate'], 0) + row['votes']
+    candidates = [
+        {'candidate': name, 'votes': votes}
+        for name, votes in sorted(merged.items(), key=lambda item: -item[1])
+    ]
+    return voters_count, total_votes, candidates
+
+
+def list_elections(fan_out, conns):
+    # shard 0's elections, with votes summed over every shard
+    per_shard = fan_out.map(db.list_elections, conns)
+    votes = {}
+    for rows in per_shard:
+        for row in rows:
+            votes[row['id']] = votes.get(row['id'], 0) + row['votes']
+    return [
+        {
+            'id': row['id'],
+            'started_at': row['started_at'],
+            'votes': votes[row['id']],
+            'archived_to': row['archived_to'],
+        }
+        for row in per_shard[0]
+    ]
+
+
+def start_election(conns):
+    # Give every shard the same new election id. Shard 0 goes last, so once
+    # it reports the new election every shard already takes its ballots;
+    # re-running after a failure completes the shards that missed it.
+    election_id = max(db.current_election(conn) or 0 for conn in conns)
+    if all(db.current_election(conn) == election_id for conn in conns):
+        election_id += 1
+    for conn in conns[1:] + conns[:1]:
+        db.start_election(conn, election_id)
+    return election_id
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    # a migrated database file with an empty roll
+    path = str(tmp_path / "test.db")
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def add_voters():
+    def add(path, count):
+        conn = db.connect(path)
+        conn.executemany(
+            "INSERT INTO voters (aadhaar_hash, mobile) VALUES (?, ?)",
+            ((f"voter{i}", "9999999999") for i in range(count))
+        )
+        db.count_voters(conn, count)
+        conn.commit()
+        conn.close()
+        return list(range(1, count + 1))
+    return add
@@ -0,0 +1,35 @@
+import pytest
+
+import archive
+import db
+
+
+def test_archive_is_claimed_across_processes(database, add_voters, tmp_path):
+    voter_ids = add_voters(database, 3)
+    conn = db.connect(database)
+    try:
+        for voter_id in voter_ids:
+            assert db.cast_ballot(conn, voter_id, "cand0") == db.CAST
+        db.start_election(conn)
+    finally:
+        conn.close()
+    archive_dir = str(tmp_path / "archive")
+
+    # a lock held through another open file stands in for another worker
+    held = archive._claim_all([database], 1, archive_dir)
+    try:
+        assert archive.start_archive([database], 1, archive_dir) is False
+        with pytest.raises(ValueError, match="already being archived"):
+            archive.archive_election(database, 1, archive_dir)
+    finally:
+        for lock in held:
+            lock.close()
+
+    path, deleted = archive.archive_election(database, 1, archive_dir)
+    assert path == archive.archive_path(archive_dir, 1)
+    assert deleted == 6
+    conn = db.connect(database)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM votes").fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,121 @@
+# Many threads race to cast ballots for the same voters; every voter must
+# end up with exactly one CAST and the running tallies must match a recount.
+import random
+import sqlite3
+import threading
+from collections import Counter
+
+import db
+from ballot_queue import BallotQueue
+
+THREADS = 16
+VOTERS = 60
+
+
+def race(cast, voter_ids):
+    # every thread tries every voter, in its own order; returns per-voter outcomes
+    outcomes = {voter_id: Counter() for voter_id in voter_ids}
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def worker(n):
+        ids = list(voter_ids)
+        random.Random(n).shuffle(ids)
+        barrier.wait()
+        for voter_id in ids:
+            outcome = cast(voter_id, f"cand{n % 4}")
+            with lock:
+                outcomes[voter_id][outcome] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return outcomes
+
+
+def assert_one_ballot_each(path, outcomes):
+    for voter_id, counts in outcomes.items():
+        assert counts[db.CAST] == 1, (voter_id, counts)
+        assert sum(counts.values()) == THREADS
+
+    conn = db.connect(path)
+    try:
+        per_voter = dict(conn.execute(
+            "SELECT voter_id, COUNT(*) FROM votes GROUP BY election_id, voter_id"
+        ).fetchall())
+        assert per_voter == {voter_id: 1 for voter_id in outcomes}
+        assert conn.execute("SELECT COUNT(*) FROM turnout").fetchone()[0] == len(outcomes)
+        assert db.check_tallies(conn) == []
+    finally:
+        conn.close()
+
+
+def test_cast_ballot_races(database, add_voters):
+    voter_ids = add_voters(database, VOTERS)
+    pool = db.ConnectionPool(database, THREADS)
+    local = threading.local()
+
+    def cast(voter_id, candidate):
+        if not hasattr(local, "conn"):
+            local.conn = pool.acquire()
+        return db.cast_ballot(local.conn, voter_id, candidate)
+
+    try:
+        assert_one_ballot_each(database, race(cast, voter_ids))
+    finally:
+        pool.close()
+
+
+def test_ballot_queue_races(database, add_voters):
+    voter_ids = add_voters(database, VOTERS)
+    ballots = BallotQueue(database, max_batch=32, max_wait_ms=2)
+    try:
+        outcomes = race(ballots.cast, voter_ids)
+    finally:
+        ballots.shutdown()
+    assert_one_ballot_each(database, outcomes)
+
+
+def test_ballot_queue_isolates_a_bad_ballot(database, add_voters):
+    voter_ids = add_voters(database, 3)
+    ballots = BallotQueue(database, max_batch=8, max_wait_ms=50)
+    try:
+        futures = [
+            ballots.submit(voter_ids[0], "cand0"),
+            ballots.submit(voter_ids[1], None),
+            ballots.submit(voter_ids[2], "cand1"),
+        ]
+        assert futures[0].result(5) == db.CAST
+        assert isinstance(futures[1].exception(5), sqlite3.IntegrityError)
+        assert futures[2].result(5) == db.CAST
+        # the failed ballot left no turnout claim behind, so it can be recast
+        assert ballots.cast(voter_ids[1], "cand2") == db.CAST
+    finally:
+        ballots.shutdown()
+
+    conn = db.connect(database)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM votes").fetchone()[0] == 3
+        assert db.check_tallies(conn) == []
+    finally:
+        conn.close()
+
+
+def test_ballot_queue_cast_times_out(database, add_voters):
+    voter_ids = add_voters(database, 2)
+    ballots = BallotQueue(database, max_wait_ms=1)
+    blocker = db.connect(database)
+    try:
+        # hold the write lock so the writer is stuck in BEGIN IMMEDIATE
+        blocker.execute("BEGIN IMMEDIATE")
+        # the first ballot is taken by the writer and may still land later
+        ballots.cast(voter_ids[1], "cand0", timeout=0.2)
+        # the second is still queued, so giving up withdraws it
+        assert ballots.cast(voter_ids[0], "cand0", timeout=0.2) == db.CONTENTION
+        blocker.rollback()
+        assert ballots.cast(voter_ids[0], "cand1") == db.CAST
+    finally:
+        blocker.close()
+        ballots.shutdown()
@@ -0,0 +1,21 @@
+import db
+import migrations
+
+
+def test_migrate_is_idempotent(database):
+    conn = db.connect(database)
+    try:
+        assert migrations.migrate(conn) == []
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        assert version == migrations.MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+
+
+def test_hot_queries_use_indexes(database):
+    # the same check as `flask check-query-plans`
+    conn = db.connect(database)
+    try:
+        assert migrations.table_scans(conn) == {}
+    finally:
+        conn.close()